@@ -1160,15 +1160,25 @@ class CallClassificationEngine:
 
         return "Не записан"
 
-    def process_folder(self, input_folder, output_file, context_days=7, progress_callback=None):
-        """Обработка папки с файлами транскрипций"""
+    def process_folder(
+        self, input_folder, output_file, context_days=7, progress_callback=None, files=None, save=True
+    ):
+        """Обработка папки с файлами транскрипций.
+
+        files — уже полученный вызывающим список имён .txt в input_folder: папка
+        тогда повторно не проверяется и не перечитывается.
+        save=False — не писать Excel: вызывающий сохранит results через
+        save_results_to_excel сам (например, в отдельном потоке записи).
+        """
         results = []
         total_calls = 0
 
-        if not os.path.exists(input_folder):
-            raise FileNotFoundError(f"Папка {input_folder} не найдена")
-
-        text_files = [f for f in os.listdir(input_folder) if f.endswith(".txt")]
+        if files is not None:
+            text_files = list(files)
+        else:
+            if not os.path.exists(input_folder):
+                raise FileNotFoundError(f"Папка {input_folder} не найдена")
+            text_files = [f for f in os.listdir(input_folder) if f.endswith(".txt")]
         if not text_files:
             raise ValueError(f"В папке {input_folder} не найдено .txt файлов")
 
@@ -1364,7 +1374,8 @@ class CallClassificationEngine:
         self.training_manager.update_daily_metrics(today, total_calls, total_calls, 0)
         
         # Сохраняем результаты в Excel
-        self.save_results_to_excel(results, output_file)
+        if save:
+            self.save_results_to_excel(results, output_file)
         
         return results, 0, total_calls
 
@@ -7,9 +7,16 @@ from __future__ import annotations
 
 import json
 import os
+import re
+import threading
+import time
+from bisect import bisect_right
 from datetime import date, datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, not_, update
 
 from database.models import (
     UserAutoExtractedRule,
@@ -23,6 +30,95 @@ from database.models import (
 )
 
 
+# user_id, для которых в этом процессе уже проверены настройки и правила по умолчанию
+_bootstrapped_user_ids: set = set()
+_bootstrap_lock = threading.Lock()
+
+# Версия правил/промптов по user_id: любое изменение увеличивает её, и кэш
+# отрендеренного промпта во всех менеджерах процесса становится невалидным.
+# Изменения из других процессов подхватываются по истечении TTL.
+_RULES_CACHE_TTL = 30.0
+_rules_versions: Dict[int, int] = {}
+
+
+# Кэш get_setting по (user_id, key): настройки читаются на каждый запуск расписания и
+# отправку отчёта, а меняются редко. set_setting сбрасывает ключ сразу, изменения
+# из других процессов видны по истечении TTL.
+_SETTINGS_CACHE_TTL = 60.0
+_SETTING_MISSING = object()
+_settings_cache: Dict[Tuple[int, str], Tuple[float, Any]] = {}
+
+
+def invalidate_settings_cache(user_id: int, key: Optional[str] = None) -> None:
+    """Сбросить кэш настроек пользователя (один ключ или все)."""
+    uid = int(user_id)
+    if key is not None:
+        _settings_cache.pop((uid, key), None)
+        return
+    for cache_key in [k for k in list(_settings_cache) if k[0] == uid]:
+        _settings_cache.pop(cache_key, None)
+
+
+@lru_cache(maxsize=256)
+def _parse_schedule_config(raw: str) -> Dict:
+    """JSON schedule_config → dict; разобранный конфиг общий для вызовов, его нельзя менять."""
+    try:
+        config = json.loads(raw) if raw else {}
+    except ValueError:
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def due_schedule_user_ids(now: Optional[datetime] = None) -> List[int]:
+    """user_id, у которых есть активные расписания с наступившим next_run (частичный индекс idx_ucsch_active_due)."""
+    now = now or datetime.now()
+    rows = (
+        db.session.query(UserClassificationSchedule.user_id)
+        .filter(
+            UserClassificationSchedule.is_active.is_(True),
+            UserClassificationSchedule.next_run <= now,
+        )
+        .distinct()
+    )
+    return [int(uid) for (uid,) in rows]
+
+
+def invalidate_rules_cache(user_id: int) -> None:
+    """Сбросить кэш правил/промпта пользователя (после изменения правил вне менеджера)."""
+    uid = int(user_id)
+    _rules_versions[uid] = _rules_versions.get(uid, 0) + 1
+
+
+# Обязательный хвост системного промпта: добавляется, если его ещё нет в тексте
+_STRICT_FORMAT_BLOCK = """
+
+ФИНАЛЬНЫЙ ФОРМАТ ОТВЕТА (обязателен всегда, даже если выше в промпте указано иначе):
+Верни строго только две строки:
+[КАТЕГОРИЯ:IN.* или OUT.*]
+[ОБОСНОВАНИЕ:краткое понятное объяснение на русском языке, 1-3 предложения]
+
+Правила финального ответа:
+- только русский язык
+- без markdown и списков
+- без английских фраз вроде Category, Explanation, Summary, Here's why
+- без дополнительного текста до или после этих двух строк
+- код категории должен быть одним из допустимых кодов IN.* / OUT.*
+"""
+_STRICT_FORMAT_MARKER = _STRICT_FORMAT_BLOCK.strip()
+
+# Плейсхолдеры системного промпта подставляются за один проход по тексту
+_PLACEHOLDER_RE = re.compile(
+    r"\{(CALL_TYPE|CALL_HISTORY|TRAINING_EXAMPLES|CATEGORY_RULES|AUTO_RULES|CRITICAL_RULES)\}"
+)
+
+
+@lru_cache(maxsize=8)
+def _parse_template(template: str) -> Tuple[Tuple[str, ...], frozenset, bool]:
+    """Разбор шаблона один раз: (литералы и имена плейсхолдеров вперемежку, имена, есть ли хвост формата)."""
+    parts = tuple(_PLACEHOLDER_RE.split(template))
+    return parts, frozenset(parts[1::2]), _STRICT_FORMAT_MARKER in template
+
+
 def _parse_dt(val: Any) -> Optional[datetime]:
     if val is None or val == "":
         return None
@@ -42,6 +138,85 @@ def _to_iso(val: Any) -> Any:
     return val
 
 
+# Приведение полей update_classification_task; None после приведения — поле пропускается
+_TASK_FIELD_CASTS = {
+    "status": str,
+    "total_files": int,
+    "processed_files": int,
+    "corrections_count": int,
+    "duration": str,
+    "error_message": str,
+    "end_time": _parse_dt,
+}
+
+
+def _normalize_schedule_config(schedule_config) -> Any:
+    if schedule_config is None:
+        return {}
+    if isinstance(schedule_config, dict):
+        return schedule_config
+    if isinstance(schedule_config, str):
+        try:
+            return json.loads(schedule_config)
+        except json.JSONDecodeError:
+            return {}
+    return {}
+
+
+def _same(value: Any) -> Any:
+    return value
+
+
+# Приведение полей update_schedule; для полей из _SCHEDULE_NULLABLE_UPDATES None
+# тоже записывается (через приведение), для остальных — пропускается
+_SCHEDULE_FIELD_CASTS = {
+    "name": _same,
+    "description": _same,
+    "input_folder": _same,
+    "schedule_type": _same,
+    "schedule_config": _normalize_schedule_config,
+    "context_days": int,
+    "is_active": bool,
+    "next_run": _parse_dt,
+}
+_SCHEDULE_NULLABLE_UPDATES = frozenset({"name", "description", "input_folder", "schedule_type", "schedule_config"})
+
+# Списки читаются проекцией колонок: строки приходят кортежами без сборки
+# ORM-объектов и identity map, а _hist_dict/_sched_dict читают их по именам.
+_HIST_COLUMNS = (
+    UserClassificationHistory.task_id,
+    UserClassificationHistory.input_folder,
+    UserClassificationHistory.output_file,
+    UserClassificationHistory.context_days,
+    UserClassificationHistory.status,
+    UserClassificationHistory.total_files,
+    UserClassificationHistory.processed_files,
+    UserClassificationHistory.corrections_count,
+    UserClassificationHistory.start_time,
+    UserClassificationHistory.end_time,
+    UserClassificationHistory.duration,
+    UserClassificationHistory.error_message,
+    UserClassificationHistory.operator_name,
+)
+_SCHED_COLUMNS = (
+    UserClassificationSchedule.id,
+    UserClassificationSchedule.name,
+    UserClassificationSchedule.description,
+    UserClassificationSchedule.input_folder,
+    UserClassificationSchedule.context_days,
+    UserClassificationSchedule.schedule_type,
+    UserClassificationSchedule.schedule_config,
+    UserClassificationSchedule.is_active,
+    UserClassificationSchedule.last_run,
+    UserClassificationSchedule.next_run,
+    UserClassificationSchedule.created_at,
+    UserClassificationSchedule.created_by,
+    UserClassificationSchedule.run_count,
+    UserClassificationSchedule.success_count,
+    UserClassificationSchedule.error_count,
+)
+
+
 class ClassificationRulesManager:
     """Менеджер для управления правилами классификации и промптами (per user_id)."""
 
@@ -63,8 +238,9 @@ class ClassificationRulesManager:
         self._classification_root: Optional[Path] = None
         if classification_root is not None:
             self._classification_root = Path(classification_root).resolve()
-        self._ensure_notify_defaults()
-        self._load_default_rules()
+        # (версия правил, time.monotonic(), активный промпт, тексты блоков правил)
+        self._prompt_cache: Optional[Tuple[int, float, Optional[Dict], Tuple[str, str, str]]] = None
+        self._bootstrap_user()
 
     @property
     def classification_root(self) -> Path:
@@ -73,6 +249,21 @@ class ClassificationRulesManager:
             return self._classification_root
         return Path()
 
+    def _bootstrap_user(self) -> None:
+        """Начальные настройки и правила — один раз на user_id в рамках процесса.
+
+        Менеджер создаётся на каждый HTTP-запрос и в каждой фоновой задаче;
+        без этого каждое создание стоило ~8 запросов к БД и лишний commit.
+        """
+        if self.user_id in _bootstrapped_user_ids:
+            return
+        with _bootstrap_lock:
+            if self.user_id in _bootstrapped_user_ids:
+                return
+            self._ensure_notify_defaults()
+            self._load_default_rules()
+            _bootstrapped_user_ids.add(self.user_id)
+
     def _ensure_notify_defaults(self) -> None:
         """Telegram/MAX ключи по умолчанию (как INSERT OR IGNORE в SQLite)."""
         defaults = [
@@ -94,6 +285,7 @@ class ClassificationRulesManager:
                     )
                 )
         db.session.commit()
+        invalidate_settings_cache(self.user_id)
 
     def _load_default_rules(self) -> None:
         """Загрузка стандартных правил при первом запуске"""
@@ -346,7 +538,7 @@ class ClassificationRulesManager:
             "id": p.id,
             "name": p.name,
             "content": p.content,
-            "is_active": bool(p.is_active),
+            "is_active": p.is_active,
             "created_at": _to_iso(p.created_at),
             "updated_at": _to_iso(p.updated_at),
             "description": p.description,
@@ -368,6 +560,7 @@ class ClassificationRulesManager:
                 )
             )
             db.session.commit()
+            self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -385,6 +578,7 @@ class ClassificationRulesManager:
             p.content = content
             p.description = description or ""
             db.session.commit()
+            self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -402,6 +596,7 @@ class ClassificationRulesManager:
             if p:
                 p.is_active = True
             db.session.commit()
+            self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -416,6 +611,7 @@ class ClassificationRulesManager:
             if p:
                 db.session.delete(p)
                 db.session.commit()
+                self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -438,7 +634,7 @@ class ClassificationRulesManager:
             "category_name": r.category_name,
             "rule_text": r.rule_text,
             "priority": r.priority,
-            "is_active": bool(r.is_active),
+            "is_active": r.is_active,
             "created_at": _to_iso(r.created_at),
             "updated_at": _to_iso(r.updated_at),
             "examples": r.examples,
@@ -475,6 +671,7 @@ class ClassificationRulesManager:
                 )
             )
             db.session.commit()
+            self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -502,6 +699,7 @@ class ClassificationRulesManager:
             r.examples = examples or None
             r.conditions = conditions or None
             db.session.commit()
+            self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -510,10 +708,12 @@ class ClassificationRulesManager:
 
     def toggle_classification_rule_active(self, rule_id: int) -> bool:
         try:
-            r = UserClassificationRule.query.filter_by(user_id=self.user_id, id=rule_id).first()
-            if r:
-                r.is_active = not r.is_active
-                db.session.commit()
+            UserClassificationRule.query.filter_by(user_id=self.user_id, id=rule_id).update(
+                {UserClassificationRule.is_active: not_(UserClassificationRule.is_active)},
+                synchronize_session=False,
+            )
+            db.session.commit()
+            self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -526,6 +726,7 @@ class ClassificationRulesManager:
             if r:
                 db.session.delete(r)
                 db.session.commit()
+                self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -546,7 +747,7 @@ class ClassificationRulesManager:
             "id": c.id,
             "name": c.name,
             "rule_text": c.rule_text,
-            "is_active": bool(c.is_active),
+            "is_active": c.is_active,
             "created_at": _to_iso(c.created_at),
             "updated_at": _to_iso(c.updated_at),
             "description": c.description,
@@ -568,6 +769,7 @@ class ClassificationRulesManager:
                 )
             )
             db.session.commit()
+            self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -585,6 +787,7 @@ class ClassificationRulesManager:
             c.rule_text = rule_text
             c.description = description or ""
             db.session.commit()
+            self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -593,12 +796,12 @@ class ClassificationRulesManager:
 
     def toggle_critical_rule_active(self, rule_id: int) -> bool:
         try:
-            c = UserClassificationCriticalRule.query.filter_by(
-                user_id=self.user_id, id=rule_id
-            ).first()
-            if c:
-                c.is_active = not c.is_active
-                db.session.commit()
+            UserClassificationCriticalRule.query.filter_by(user_id=self.user_id, id=rule_id).update(
+                {UserClassificationCriticalRule.is_active: not_(UserClassificationCriticalRule.is_active)},
+                synchronize_session=False,
+            )
+            db.session.commit()
+            self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -613,6 +816,7 @@ class ClassificationRulesManager:
             if c:
                 db.session.delete(c)
                 db.session.commit()
+                self._invalidate_rules_cache()
             return True
         except Exception as e:
             db.session.rollback()
@@ -639,84 +843,110 @@ class ClassificationRulesManager:
             for r in rows
         ]
 
-    def generate_system_prompt(
-        self, call_history: str = "", training_examples: str = "", call_type: str = "Не определен"
-    ) -> str:
+    def _invalidate_rules_cache(self) -> None:
+        self._prompt_cache = None
+        invalidate_rules_cache(self.user_id)
+
+    def _cached_prompt_parts(self) -> Tuple[Optional[Dict], Tuple[str, str, str]]:
+        """Активный промпт и отрендеренные блоки правил с TTL-кэшем."""
+        version = _rules_versions.get(self.user_id, 0)
+        now = time.monotonic()
+        cached = self._prompt_cache
+        if cached is not None and cached[0] == version and now - cached[1] < _RULES_CACHE_TTL:
+            return cached[2], cached[3]
         active_prompt = self.get_active_system_prompt()
-        if not active_prompt:
-            return "Ошибка: нет активного системного промпта"
-
-        classification_rules = self.get_active_classification_rules()
-        critical_rules = self.get_active_critical_rules()
-        auto_extracted_rules = self.get_auto_extracted_rules()
-
-        category_rules_text = ""
-        for rule in classification_rules:
-            category_rules_text += f"{rule['category_id']}. {rule['category_name']}: {rule['rule_text']}\n"
+        rendered = self._render_rules()
+        self._prompt_cache = (version, now, active_prompt, rendered)
+        return active_prompt, rendered
+
+    def _render_rules(self) -> Tuple[str, str, str]:
+        """Тексты блоков {CATEGORY_RULES}/{AUTO_RULES}/{CRITICAL_RULES}."""
+        parts: List[str] = []
+        for rule in self.get_active_classification_rules():
+            parts.append(f"{rule['category_id']}. {rule['category_name']}: {rule['rule_text']}\n")
             if rule.get("examples"):
-                category_rules_text += f"   Примеры: {rule['examples']}\n"
+                parts.append(f"   Примеры: {rule['examples']}\n")
             if rule.get("conditions"):
-                category_rules_text += f"   Условия: {rule['conditions']}\n"
-            category_rules_text += "\n"
+                parts.append(f"   Условия: {rule['conditions']}\n")
+            parts.append("\n")
+        category_rules_text = "".join(parts)
 
         auto_rules_text = ""
+        auto_extracted_rules = self.get_auto_extracted_rules()
         if auto_extracted_rules:
-            auto_rules_text = "АВТОМАТИЧЕСКИ ИЗВЛЕЧЁННЫЕ ПРАВИЛА (на основе частых ошибок):\n"
+            parts = ["АВТОМАТИЧЕСКИ ИЗВЛЕЧЁННЫЕ ПРАВИЛА (на основе частых ошибок):\n"]
             for rule in auto_extracted_rules:
                 confidence_stars = "⚠️" if rule["confidence"] >= 0.8 else "ℹ️"
-                auto_rules_text += f"{confidence_stars} {rule['rule_text']} "
-                auto_rules_text += f"(уверенность: {rule['confidence']:.0%}, примеров: {rule['example_count']})\n"
-            auto_rules_text += "\n"
-
-        critical_rules_text = ""
-        for rule in critical_rules:
-            critical_rules_text += f"- {rule['rule_text']}\n"
-
-        prompt_content = active_prompt["content"]
-        prompt_content = prompt_content.replace("{CALL_TYPE}", call_type)
-        prompt_content = prompt_content.replace("{CALL_HISTORY}", call_history or "Нет истории звонков")
-        prompt_content = prompt_content.replace(
-            "{TRAINING_EXAMPLES}", training_examples or "Нет обучающих примеров"
+                parts.append(
+                    f"{confidence_stars} {rule['rule_text']} "
+                    f"(уверенность: {rule['confidence']:.0%}, примеров: {rule['example_count']})\n"
+                )
+            parts.append("\n")
+            auto_rules_text = "".join(parts)
+
+        critical_rules_text = "".join(
+            f"- {rule['rule_text']}\n" for rule in self.get_active_critical_rules()
         )
-        prompt_content = prompt_content.replace("{CATEGORY_RULES}", category_rules_text)
 
-        if auto_rules_text and "{AUTO_RULES}" not in prompt_content:
-            if "{CRITICAL_RULES}" in prompt_content:
-                prompt_content = prompt_content.replace("{CRITICAL_RULES}", auto_rules_text + "{CRITICAL_RULES}")
-            else:
-                prompt_content += "\n\n" + auto_rules_text
-        elif "{AUTO_RULES}" in prompt_content:
-            prompt_content = prompt_content.replace("{AUTO_RULES}", auto_rules_text)
+        return category_rules_text, auto_rules_text, critical_rules_text
 
-        prompt_content = prompt_content.replace("{CRITICAL_RULES}", critical_rules_text)
+    def generate_system_prompt(
+        self, call_history: str = "", training_examples: str = "", call_type: str = "Не определен"
+    ) -> str:
+        active_prompt, rendered = self._cached_prompt_parts()
+        if not active_prompt:
+            return "Ошибка: нет активного системного промпта"
 
-        strict_format_block = """
+        category_rules_text, auto_rules_text, critical_rules_text = rendered
 
-ФИНАЛЬНЫЙ ФОРМАТ ОТВЕТА (обязателен всегда, даже если выше в промпте указано иначе):
-Верни строго только две строки:
-[КАТЕГОРИЯ:IN.* или OUT.*]
-[ОБОСНОВАНИЕ:краткое понятное объяснение на русском языке, 1-3 предложения]
+        parts, names, has_strict_format = _parse_template(active_prompt["content"])
+        subs = {
+            "CALL_TYPE": call_type,
+            "CALL_HISTORY": call_history or "Нет истории звонков",
+            "TRAINING_EXAMPLES": training_examples or "Нет обучающих примеров",
+            "CATEGORY_RULES": category_rules_text,
+            "AUTO_RULES": auto_rules_text,
+            "CRITICAL_RULES": critical_rules_text,
+        }
+        # Шаблон без {AUTO_RULES}: автоправила встают перед критическими или в конец промпта
+        append_auto_rules = False
+        if auto_rules_text and "AUTO_RULES" not in names:
+            if "CRITICAL_RULES" in names:
+                subs["CRITICAL_RULES"] = auto_rules_text + critical_rules_text
+            else:
+                append_auto_rules = True
 
-Правила финального ответа:
-- только русский язык
-- без markdown и списков
-- без английских фраз вроде Category, Explanation, Summary, Here's why
-- без дополнительного текста до или после этих двух строк
-- код категории должен быть одним из допустимых кодов IN.* / OUT.*
-"""
+        # Нечётные элементы parts — имена плейсхолдеров, чётные — литералы шаблона
+        prompt_content = "".join(subs[p] if i & 1 else p for i, p in enumerate(parts))
+        if append_auto_rules:
+            prompt_content = f"{prompt_content}\n\n{auto_rules_text}"
 
-        if strict_format_block.strip() not in prompt_content:
-            prompt_content = prompt_content.rstrip() + "\n" + strict_format_block
+        if not has_strict_format and _STRICT_FORMAT_MARKER not in prompt_content:
+            prompt_content = f"{prompt_content.rstrip()}\n{_STRICT_FORMAT_BLOCK}"
 
         return prompt_content
 
     def get_setting(self, key, default_value=None) -> Any:
-        row = UserClassificationSetting.query.filter_by(
-            user_id=self.user_id, setting_key=key
-        ).first()
-        return row.setting_value if row else default_value
+        cache_key = (self.user_id, key)
+        now = time.monotonic()
+        cached = _settings_cache.get(cache_key)
+        if cached is not None and now - cached[0] < _SETTINGS_CACHE_TTL:
+            value = cached[1]
+        else:
+            row = (
+                UserClassificationSetting.query.with_entities(UserClassificationSetting.setting_value)
+                .filter(
+                    UserClassificationSetting.user_id == self.user_id,
+                    UserClassificationSetting.setting_key == key,
+                )
+                .first()
+            )
+            value = row[0] if row else _SETTING_MISSING
+            _settings_cache[cache_key] = (now, value)
+        return default_value if value is _SETTING_MISSING else value
 
     def set_setting(self, key, value, description=None) -> None:
+        invalidate_settings_cache(self.user_id, key)
         val = str(value) if value is not None else ""
         row = UserClassificationSetting.query.filter_by(
             user_id=self.user_id, setting_key=key
@@ -735,61 +965,84 @@ class ClassificationRulesManager:
 
     def get_all_settings(self) -> List[Dict]:
         rows = (
-            UserClassificationSetting.query.filter_by(user_id=self.user_id)
+            UserClassificationSetting.query.with_entities(
+                UserClassificationSetting.setting_key,
+                UserClassificationSetting.setting_value,
+                UserClassificationSetting.description,
+            )
+            .filter(UserClassificationSetting.user_id == self.user_id)
             .order_by(UserClassificationSetting.setting_key)
-            .all()
         )
-        return [{"key": r.setting_key, "value": r.setting_value, "description": r.description} for r in rows]
+        return [{"key": k, "value": v, "description": d} for k, v, d in rows]
 
     def add_classification_task(
         self, task_id, input_folder, output_file, context_days=0, operator_name=None
     ) -> None:
-        h = UserClassificationHistory(
-            user_id=self.user_id,
-            task_id=str(task_id),
-            input_folder=input_folder,
-            output_file=output_file,
-            context_days=int(context_days or 0),
-            status="running",
-            operator_name=operator_name,
+        """Одна задача: обёртка над add_classification_tasks_bulk."""
+        self.add_classification_tasks_bulk(
+            [
+                {
+                    "task_id": task_id,
+                    "input_folder": input_folder,
+                    "output_file": output_file,
+                    "context_days": context_days,
+                    "operator_name": operator_name,
+                }
+            ]
         )
-        db.session.add(h)
+
+    def add_classification_tasks_bulk(self, rows) -> None:
+        """Добавить пачку задач (dict с ключами add_classification_task) в одной транзакции."""
+        tasks = [
+            UserClassificationHistory(
+                user_id=self.user_id,
+                task_id=str(r["task_id"]),
+                input_folder=r["input_folder"],
+                output_file=r["output_file"],
+                context_days=int(r.get("context_days") or 0),
+                status="running",
+                operator_name=r.get("operator_name"),
+            )
+            for r in rows
+        ]
+        if not tasks:
+            return
+        db.session.add_all(tasks)
         db.session.commit()
 
     def update_classification_task(self, task_id, **kwargs) -> None:
-        h = UserClassificationHistory.query.filter_by(
-            user_id=self.user_id, task_id=str(task_id)
-        ).first()
-        if not h:
-            return
+        values = {}
         for key, value in kwargs.items():
-            if key == "status" and value is not None:
-                h.status = str(value)
-            elif key == "total_files" and value is not None:
-                h.total_files = int(value)
-            elif key == "processed_files" and value is not None:
-                h.processed_files = int(value)
-            elif key == "corrections_count" and value is not None:
-                h.corrections_count = int(value)
-            elif key == "duration" and value is not None:
-                h.duration = str(value)
-            elif key == "error_message" and value is not None:
-                h.error_message = str(value)
-            elif key == "end_time" and value is not None:
-                h.end_time = _parse_dt(value) or h.end_time
+            cast = _TASK_FIELD_CASTS.get(key)
+            if cast is None or value is None:
+                continue
+            value = cast(value)
+            if value is not None:
+                values[key] = value
+        if not values:
+            return
+        UserClassificationHistory.query.filter_by(user_id=self.user_id, task_id=str(task_id)).update(
+            values, synchronize_session=False
+        )
         db.session.commit()
 
-    def get_classification_history(self, limit=10) -> List[Dict]:
-        rows = (
-            UserClassificationHistory.query.filter_by(user_id=self.user_id)
+    def iter_classification_history(self, limit=None) -> Iterator[Dict]:
+        """История задач (новые первыми) по одной записи; строки читаются пачками по 50."""
+        q = (
+            UserClassificationHistory.query.with_entities(*_HIST_COLUMNS)
+            .filter(UserClassificationHistory.user_id == self.user_id)
             .order_by(UserClassificationHistory.start_time.desc())
-            .limit(int(limit))
-            .all()
         )
-        return [self._hist_dict(h) for h in rows]
+        if limit is not None:
+            q = q.limit(int(limit))
+        for h in q.yield_per(50):
+            yield self._hist_dict(h)
+
+    def get_classification_history(self, limit=10) -> List[Dict]:
+        return list(self.iter_classification_history(limit))
 
     @staticmethod
-    def _hist_dict(h: UserClassificationHistory) -> Dict:
+    def _hist_dict(h: Any) -> Dict:
         return {
             "task_id": h.task_id,
             "input_folder": h.input_folder,
@@ -807,30 +1060,23 @@ class ClassificationRulesManager:
         }
 
     def get_classification_task(self, task_id) -> Optional[Dict]:
-        h = UserClassificationHistory.query.filter_by(
-            user_id=self.user_id, task_id=str(task_id)
-        ).first()
+        h = (
+            UserClassificationHistory.query.with_entities(*_HIST_COLUMNS)
+            .filter(
+                UserClassificationHistory.user_id == self.user_id,
+                UserClassificationHistory.task_id == str(task_id),
+            )
+            .first()
+        )
         return self._hist_dict(h) if h else None
 
-    def _normalize_schedule_config(self, schedule_config) -> Any:
-        if schedule_config is None:
-            return {}
-        if isinstance(schedule_config, dict):
-            return schedule_config
-        if isinstance(schedule_config, str):
-            try:
-                return json.loads(schedule_config)
-            except json.JSONDecodeError:
-                return {}
-        return {}
-
     def add_schedule(
         self, name, description, input_folder, context_days, schedule_type, schedule_config, created_by=None
     ):
-        cfg = self._normalize_schedule_config(schedule_config)
+        cfg = _normalize_schedule_config(schedule_config)
         if not isinstance(cfg, dict):
             cfg = {}
-        next_run_iso = self._calculate_next_run(schedule_type, json.dumps(cfg, ensure_ascii=False))
+        next_run_iso = self._calculate_next_run(schedule_type, cfg)
         s = UserClassificationSchedule(
             user_id=self.user_id,
             name=name,
@@ -847,45 +1093,92 @@ class ClassificationRulesManager:
         return s.id
 
     def update_schedule(self, schedule_id, **kwargs) -> None:
-        s = UserClassificationSchedule.query.filter_by(
-            user_id=self.user_id, id=int(schedule_id)
-        ).first()
-        if not s:
-            return
-        allowed = {
-            "name",
-            "description",
-            "input_folder",
-            "context_days",
-            "schedule_type",
-            "schedule_config",
-            "is_active",
-            "next_run",
-        }
+        values = {}
         for key, value in kwargs.items():
-            if key not in allowed:
+            cast = _SCHEDULE_FIELD_CASTS.get(key)
+            if cast is None or (value is None and key not in _SCHEDULE_NULLABLE_UPDATES):
                 continue
-            if key == "schedule_config":
-                s.schedule_config = self._normalize_schedule_config(value)
-            elif key == "context_days" and value is not None:
-                s.context_days = int(value)
-            elif key == "is_active" and value is not None:
-                s.is_active = bool(value)
-            elif key == "next_run" and value is not None:
-                s.next_run = _parse_dt(value) if not isinstance(value, datetime) else value
-            elif hasattr(s, key):
-                setattr(s, key, value)
+            values[key] = cast(value)
+        if not values:
+            return
+        UserClassificationSchedule.query.filter_by(user_id=self.user_id, id=int(schedule_id)).update(
+            values, synchronize_session=False
+        )
         db.session.commit()
 
     def get_schedules(self, active_only=True) -> List[Dict]:
-        q = UserClassificationSchedule.query.filter_by(user_id=self.user_id)
+        q = UserClassificationSchedule.query.with_entities(*_SCHED_COLUMNS).filter(
+            UserClassificationSchedule.user_id == self.user_id
+        )
         if active_only:
-            q = q.filter_by(is_active=True)
-        rows = q.order_by(UserClassificationSchedule.next_run.asc()).all()
+            q = q.filter(UserClassificationSchedule.is_active.is_(True))
+        rows = q.order_by(UserClassificationSchedule.next_run.asc())
         return [self._sched_dict(s) for s in rows]
 
+    def get_schedules_summary(self, active_only=True) -> List[Dict]:
+        """Краткий список расписаний (id, name, is_active, next_run) для счётчиков и цикла планировщика."""
+        q = UserClassificationSchedule.query.with_entities(
+            UserClassificationSchedule.id,
+            UserClassificationSchedule.name,
+            UserClassificationSchedule.is_active,
+            UserClassificationSchedule.next_run,
+        ).filter(UserClassificationSchedule.user_id == self.user_id)
+        if active_only:
+            q = q.filter(UserClassificationSchedule.is_active.is_(True))
+        return [
+            {"id": sid, "name": name, "is_active": is_active, "next_run": _to_iso(next_run)}
+            for sid, name, is_active, next_run in q.order_by(UserClassificationSchedule.next_run.asc())
+        ]
+
+    def get_schedule_exec_params(self, schedule_id) -> Optional[Dict]:
+        """Параметры запуска расписания: input_folder, context_days, schedule_type, schedule_config."""
+        row = (
+            UserClassificationSchedule.query.with_entities(
+                UserClassificationSchedule.input_folder,
+                UserClassificationSchedule.context_days,
+                UserClassificationSchedule.schedule_type,
+                UserClassificationSchedule.schedule_config,
+            )
+            .filter(
+                UserClassificationSchedule.user_id == self.user_id,
+                UserClassificationSchedule.id == int(schedule_id),
+            )
+            .first()
+        )
+        if not row:
+            return None
+        cfg = row.schedule_config
+        return {
+            "input_folder": row.input_folder,
+            "context_days": row.context_days,
+            "schedule_type": row.schedule_type,
+            "schedule_config": json.dumps(cfg, ensure_ascii=False) if isinstance(cfg, dict) else str(cfg or "{}"),
+        }
+
+    def get_schedule_config(self, schedule_id, raw=None) -> Optional[Dict]:
+        """Разобранный schedule_config (не изменять: словарь общий для вызовов).
+
+        raw — уже имеющийся у вызывающего конфиг (JSON-строка из get_due_schedules
+        или dict): строка разбирается через кэш, без обращения к БД.
+        """
+        if isinstance(raw, dict):
+            return raw
+        if isinstance(raw, str):
+            return _parse_schedule_config(raw)
+        row = (
+            UserClassificationSchedule.query.with_entities(UserClassificationSchedule.schedule_config)
+            .filter(
+                UserClassificationSchedule.user_id == self.user_id,
+                UserClassificationSchedule.id == int(schedule_id),
+            )
+            .first()
+        )
+        if not row:
+            return None
+        return _normalize_schedule_config(row[0])
+
     @staticmethod
-    def _sched_dict(s: UserClassificationSchedule) -> Dict:
+    def _sched_dict(s: Any) -> Dict:
         cfg = s.schedule_config
         if isinstance(cfg, dict):
             cfg_str = json.dumps(cfg, ensure_ascii=False)
@@ -899,7 +1192,7 @@ class ClassificationRulesManager:
             "context_days": s.context_days,
             "schedule_type": s.schedule_type,
             "schedule_config": cfg_str,
-            "is_active": bool(s.is_active),
+            "is_active": s.is_active,
             "last_run": _to_iso(s.last_run),
             "next_run": _to_iso(s.next_run),
             "created_at": _to_iso(s.created_at),
@@ -910,9 +1203,14 @@ class ClassificationRulesManager:
         }
 
     def get_schedule(self, schedule_id) -> Optional[Dict]:
-        s = UserClassificationSchedule.query.filter_by(
-            user_id=self.user_id, id=int(schedule_id)
-        ).first()
+        s = (
+            UserClassificationSchedule.query.with_entities(*_SCHED_COLUMNS)
+            .filter(
+                UserClassificationSchedule.user_id == self.user_id,
+                UserClassificationSchedule.id == int(schedule_id),
+            )
+            .first()
+        )
         return self._sched_dict(s) if s else None
 
     def delete_schedule(self, schedule_id) -> None:
@@ -924,27 +1222,101 @@ class ClassificationRulesManager:
             db.session.commit()
 
     def update_schedule_run_stats(self, schedule_id, success=True) -> None:
-        s = UserClassificationSchedule.query.filter_by(
-            user_id=self.user_id, id=int(schedule_id)
-        ).first()
-        if not s:
-            return
-        s.run_count = int(s.run_count or 0) + 1
-        if success:
-            s.success_count = int(s.success_count or 0) + 1
-        else:
-            s.error_count = int(s.error_count or 0) + 1
-        s.last_run = datetime.utcnow()
+        # Один UPDATE одной формы для успеха и ошибки: инкременты считаются в SQL
+        ok, failed = (1, 0) if success else (0, 1)
+        S = UserClassificationSchedule
+        S.query.filter_by(user_id=self.user_id, id=int(schedule_id)).update(
+            {
+                S.run_count: func.coalesce(S.run_count, 0) + 1,
+                S.success_count: func.coalesce(S.success_count, 0) + ok,
+                S.error_count: func.coalesce(S.error_count, 0) + failed,
+                S.last_run: datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
         db.session.commit()
 
+    def bulk_update_schedule_runs(self, results) -> None:
+        """Записать итоги пачки расписаний одним executemany и одним commit.
+
+        results: [(schedule_id, success, next_run_iso)]; success=None — расписание
+        только переносится на next_run, счётчики и last_run не меняются.
+        """
+        rows = []
+        now = datetime.utcnow()
+        for schedule_id, success, next_run in results:
+            ran = success is not None
+            rows.append(
+                {
+                    "b_id": int(schedule_id),
+                    "b_ran": int(ran),
+                    "b_ok": int(success is True),
+                    "b_failed": int(success is False),
+                    "b_last_run": now if ran else None,
+                    "b_next_run": _parse_dt(next_run),
+                }
+            )
+        if not rows:
+            return
+        t = UserClassificationSchedule.__table__
+        stmt = (
+            update(t)
+            .where(t.c.id == bindparam("b_id"), t.c.user_id == self.user_id)
+            .values(
+                run_count=t.c.run_count + bindparam("b_ran"),
+                success_count=t.c.success_count + bindparam("b_ok"),
+                error_count=t.c.error_count + bindparam("b_failed"),
+                last_run=func.coalesce(bindparam("b_last_run", type_=t.c.last_run.type), t.c.last_run),
+                next_run=func.coalesce(bindparam("b_next_run", type_=t.c.next_run.type), t.c.next_run),
+            )
+        )
+        try:
+            db.session.execute(stmt, rows)
+            db.session.commit()
+        except Exception:
+            # Иначе следующие запросы в этой сессии упадут на прерванной транзакции
+            db.session.rollback()
+            raise
+
+    def advance_due_schedules(self, schedules: List[Dict]) -> None:
+        """Перенести next_run у пачки расписаний из get_due_schedules одним UPDATE."""
+        self.bulk_update_schedule_runs(
+            [
+                (s["id"], None, self._calculate_next_run(s["schedule_type"], s["schedule_config"]))
+                for s in schedules
+            ]
+        )
+
+    def get_next_schedule_time(self) -> Optional[datetime]:
+        """Ближайший next_run среди активных расписаний пользователя (None — расписаний нет)."""
+        return (
+            db.session.query(func.min(UserClassificationSchedule.next_run))
+            .filter(
+                UserClassificationSchedule.user_id == self.user_id,
+                UserClassificationSchedule.is_active.is_(True),
+            )
+            .scalar()
+        )
+
     def get_due_schedules(self) -> List[Dict]:
         now = datetime.now()
         rows = (
-            UserClassificationSchedule.query.filter_by(user_id=self.user_id, is_active=True)
-            .filter(UserClassificationSchedule.next_run != None)  # noqa: E711
-            .filter(UserClassificationSchedule.next_run <= now)
+            UserClassificationSchedule.query.with_entities(
+                UserClassificationSchedule.id,
+                UserClassificationSchedule.name,
+                UserClassificationSchedule.input_folder,
+                UserClassificationSchedule.context_days,
+                UserClassificationSchedule.schedule_type,
+                UserClassificationSchedule.schedule_config,
+                UserClassificationSchedule.next_run,
+            )
+            .filter(
+                UserClassificationSchedule.user_id == self.user_id,
+                UserClassificationSchedule.is_active.is_(True),
+                UserClassificationSchedule.next_run != None,  # noqa: E711
+                UserClassificationSchedule.next_run <= now,
+            )
             .order_by(UserClassificationSchedule.next_run.asc())
-            .all()
         )
         out = []
         for s in rows:
@@ -963,28 +1335,27 @@ class ClassificationRulesManager:
             )
         return out
 
-    def update_next_run(self, schedule_id) -> None:
-        s = UserClassificationSchedule.query.filter_by(
-            user_id=self.user_id, id=int(schedule_id)
-        ).first()
-        if not s:
-            return
-        cfg = s.schedule_config or {}
-        nriso = self._calculate_next_run(s.schedule_type, json.dumps(cfg, ensure_ascii=False))
-        s.next_run = _parse_dt(nriso)
+    def update_next_run(self, schedule_id, schedule_type=None, schedule_config=None) -> None:
+        """Пересчитать next_run; если тип и конфиг переданы вызывающим, строка не перечитывается."""
+        if schedule_type is None:
+            params = self.get_schedule_exec_params(schedule_id)
+            if not params:
+                return
+            schedule_type, schedule_config = params["schedule_type"], params["schedule_config"]
+        nriso = self._calculate_next_run(schedule_type, schedule_config)
+        UserClassificationSchedule.query.filter_by(user_id=self.user_id, id=int(schedule_id)).update(
+            {UserClassificationSchedule.next_run: _parse_dt(nriso)}, synchronize_session=False
+        )
         db.session.commit()
 
     def _calculate_next_run(self, schedule_type, schedule_config) -> str:
         from datetime import datetime, timedelta
 
-        try:
-            if isinstance(schedule_config, str):
-                config = json.loads(schedule_config) if schedule_config else {}
-            elif isinstance(schedule_config, dict):
-                config = schedule_config
-            else:
-                config = {}
-        except Exception:
+        if isinstance(schedule_config, dict):
+            config = schedule_config
+        elif isinstance(schedule_config, str):
+            config = _parse_schedule_config(schedule_config)
+        else:
             config = {}
 
         now = datetime.now()
@@ -1000,16 +1371,12 @@ class ClassificationRulesManager:
             hour = config.get("hour", 9)
             minute = config.get("minute", 0)
             current_weekday = now.weekday() + 1
-            next_weekday = None
-            for day in sorted(days):
-                if day > current_weekday:
-                    next_weekday = day
-                    break
-            if next_weekday is None:
-                next_weekday = min(days)
-                days_ahead = 7 - current_weekday + next_weekday
-            else:
-                days_ahead = next_weekday - current_weekday
+            days_sorted = sorted(days)
+            # Ближайший день строго после сегодняшнего, иначе первый день следующей недели;
+            # "% 7 or 7" покрывает и переход через неделю, и тот же день через 7 дней
+            idx = bisect_right(days_sorted, current_weekday)
+            next_weekday = days_sorted[idx] if idx < len(days_sorted) else days_sorted[0]
+            days_ahead = (next_weekday - current_weekday) % 7 or 7
             next_run = now + timedelta(days=days_ahead)
             next_run = next_run.replace(hour=hour, minute=minute, second=0, microsecond=0)
         elif schedule_type == "monthly":
@@ -4,11 +4,18 @@
 Планировщик задач для автоматического запуска классификации
 """
 
+import heapq
+import io
 import time
 import threading
 import json
 import logging
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 from datetime import datetime
+from typing import Optional
 try:
     from .classification_rules import ClassificationRulesManager
     from .classification_engine import CallClassificationEngine
@@ -18,13 +25,93 @@ except ImportError:
     from classification_engine import CallClassificationEngine
     from max_notify import send_excel_report_to_max
 import os
+import sys
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Настройка логирования для планировщика
 logger = logging.getLogger(__name__)
 
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Общая HTTP-сессия: keep-alive соединение к api.telegram.org переиспользуется между отчётами.
+# Повторяются только ошибки соединения — до отправки тела, поэтому потоковое тело не читается дважды.
+_http = requests.Session()
+_http.mount(
+    'https://',
+    HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=4,
+        max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.5),
+    ),
+)
+
+
+@dataclass(slots=True)
+class TaskProgress:
+    """Прогресс выполнения расписания; поля обновляются на месте потоком расписания."""
+    status: str = 'running'
+    progress: int = 0
+    processed_files: int = 0
+    total_files: int = 0
+    current_file: str = ''
+    message: str = 'Подготовка...'
+    start_time: float = 0.0
+    output_file: Optional[str] = None
+    duration: str = ''
+    total_calls: int = 0
+    error: Optional[str] = None
+
+
+class _MultipartFileBody:
+    """multipart/form-data с файлом, который читается с диска порциями при отправке.
+
+    requests с files= собирает всё тело в памяти; объект с read() и __len__
+    уходит в сокет потоково и с Content-Length, без chunked-кодирования.
+    """
+
+    def __init__(self, fields, file_field, file_path, content_type, chunk_size=65536):
+        boundary = uuid.uuid4().hex
+        head = ''.join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        )
+        head += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+            f'filename="{os.path.basename(file_path)}"\r\nContent-Type: {content_type}\r\n\r\n'
+        )
+        head = head.encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('ascii')
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        self._file = open(file_path, 'rb', buffering=chunk_size)
+        self._length = len(head) + os.fstat(self._file.fileno()).st_size + len(tail)
+        self._parts = [io.BytesIO(head), self._file, io.BytesIO(tail)]
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(part.read() for part in self._parts)
+        while self._parts:
+            chunk = self._parts[0].read(size)
+            if chunk:
+                return chunk
+            self._parts.pop(0)
+        return b''
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 class ClassificationScheduler:
     def __init__(self, rules_manager, classification_engine, upload_folder="uploads", flask_app=None):
         self.rules_manager = rules_manager
@@ -33,10 +120,24 @@ class ClassificationScheduler:
         self.flask_app = flask_app
         self.running = False
         self.scheduler_thread = None
-        self.check_interval = 60  # Проверяем каждую минуту
+        self.check_interval = 60  # Максимальный интервал между проверками
+        self._wake = threading.Event()  # Будит цикл раньше срока (stop, run_schedule_now, изменения расписаний)
+        self._next_fire = None  # Ближайший next_run из последней проверки; до него выборка due пропускается
         self.running_tasks = set()  # Отслеживаем выполняющиеся задачи
-        self.task_progress = {}  # Прогресс выполнения задач: {schedule_id: {...}}
+        # Прогресс выполнения задач: {schedule_id: TaskProgress} в порядке запуска, не больше max_progress_entries
+        self.task_progress = OrderedDict()
+        self.max_progress_entries = 256
         self.lock = threading.Lock()  # Блокировка для потокобезопасности
+        self.executor = None  # Пул для параллельного выполнения расписаний, создаётся в start()
+        self._queued = {}  # schedule_id -> Future ещё не завершённых запусков в пуле
+        self.max_workers = min(8, (os.cpu_count() or 2) * 2)
+        self.progress_ttl = 60  # Сколько секунд хранить прогресс завершённого расписания
+        self._cleanup_heap = []  # (monotonic-время удаления, schedule_id)
+        self._cleanup_cond = threading.Condition(self.lock)
+        self._reaper_thread = None
+        # Запись xlsx — в отдельном потоке; не больше двух отчётов в очереди на запись
+        self._writer = None
+        self._writer_slots = threading.BoundedSemaphore(2)
         
     def start(self):
         """Запустить планировщик"""
@@ -44,87 +145,168 @@ class ClassificationScheduler:
             return
             
         self.running = True
+        self._wake.clear()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='cls-sched')
         self.scheduler_thread = threading.Thread(target=self._scheduler_loop, daemon=True)
         self.scheduler_thread.start()
-        print("Планировщик задач запущен")
+        logger.info("Планировщик задач запущен")
     
     def stop(self):
         """Остановить планировщик"""
         self.running = False
+        self._wake.set()
         if self.scheduler_thread:
-            self.scheduler_thread.join()
-        print("Планировщик задач остановлен")
+            # Цикл ждёт на _wake, поэтому выходит сразу; текущая проверка расписаний — не дольше таймаута
+            self.scheduler_thread.join(timeout=5)
+            if self.scheduler_thread.is_alive():
+                logger.warning("Поток планировщика не завершился за 5 с")
+            self.scheduler_thread = None
+        if self.executor is not None:
+            # Очередь пула отменяем сами: у отменённого запуска не выполнится finally
+            # с _schedule_cleanup, и расписание навсегда осталось бы «выполняющимся»
+            for schedule_id, future in list(self._queued.items()):
+                if future.cancel():
+                    with self.lock:
+                        self.running_tasks.discard(schedule_id)
+                        self.task_progress.pop(schedule_id, None)
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        with self.lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.shutdown(wait=False)
+        logger.info("Планировщик задач остановлен")
     
+    def wake(self):
+        """Разбудить цикл планировщика (после изменения расписаний)"""
+        self._next_fire = None
+        self._wake.set()
+
     def _scheduler_loop(self):
-        """Основной цикл планировщика"""
+        """Основной цикл планировщика: спит до ближайшего next_run, но не дольше check_interval"""
         while self.running:
+            timeout = self.check_interval
             try:
                 if self.flask_app is not None:
                     with self.flask_app.app_context():
                         self._check_and_run_schedules()
+                        timeout = self._seconds_until_next_run()
                 else:
                     self._check_and_run_schedules()
-                time.sleep(self.check_interval)
+                    timeout = self._seconds_until_next_run()
             except Exception as e:
-                print(f"Ошибка в планировщике: {e}")
-                time.sleep(self.check_interval)
+                logger.error("Ошибка в планировщике: %s", e)
+            self._wake.wait(timeout=timeout)
+            self._wake.clear()
+
+    def _seconds_until_next_run(self):
+        """Сколько ждать до ближайшего расписания; расписания из веб-интерфейса подхватываются за check_interval"""
+        next_run = self.rules_manager.get_next_schedule_time()
+        self._next_fire = next_run
+        if next_run is None:
+            return self.check_interval
+        delta = (next_run - datetime.now()).total_seconds()
+        return min(self.check_interval, max(1.0, delta))
     
     def _check_and_run_schedules(self):
         """Проверить и запустить расписания"""
+        # Ближайший запуск ещё не наступил — выборка заведомо пуста, next_run перечитает _seconds_until_next_run
+        if self._next_fire is not None and datetime.now() < self._next_fire:
+            return
         try:
             due_schedules = self.rules_manager.get_due_schedules()
             
             if due_schedules:
-                logger.info(f"Найдено {len(due_schedules)} расписаний для выполнения")
-                print(f"📅 Найдено {len(due_schedules)} расписаний для выполнения")
+                logger.info("📅 Найдено %d расписаний для выполнения", len(due_schedules))
             
-            for schedule in due_schedules:
+            # Дубликаты отсекаются до отправки в пул и не занимают его потоки
+            admitted = [s for s in due_schedules if self._try_admit(s['id'])]
+            if admitted:
+                # next_run переносится при постановке в очередь, а не при старте в потоке пула:
+                # иначе ожидающие запуски остаются «просроченными» и цикл опрашивает БД каждую секунду
                 try:
-                    print(f"🚀 Запуск расписания: {schedule['name']} (ID: {schedule['id']})")
-                    logger.info(f"Запуск расписания: {schedule['name']} (ID: {schedule['id']})")
-                    self._run_scheduled_classification(schedule)
+                    self.rules_manager.advance_due_schedules(admitted)
                 except Exception as e:
-                    error_msg = f"Ошибка при выполнении расписания {schedule['name']}: {e}"
-                    print(f"❌ {error_msg}")
-                    logger.error(error_msg, exc_info=True)
-                    # Обновляем статистику ошибок
-                    self.rules_manager.update_schedule_run_stats(schedule['id'], success=False)
+                    logger.error("❌ Не удалось перенести next_run расписаний: %s", e)
+
+            for schedule in admitted:
+                logger.info("🚀 Запуск расписания: %s (ID: %s)", schedule['name'], schedule['id'])
+                future = self.executor.submit(self._run_in_worker, schedule)
+                self._queued[schedule['id']] = future
+                future.add_done_callback(lambda _f, sid=schedule['id']: self._queued.pop(sid, None))
         except Exception as e:
-            logger.error(f"Критическая ошибка в _check_and_run_schedules: {e}", exc_info=True)
-            print(f"❌ Критическая ошибка при проверке расписаний: {e}")
-    
-    def _run_scheduled_classification(self, schedule):
-        """Выполнить запланированную классификацию"""
-        schedule_id = schedule['id']
-        
-        # Проверяем, не выполняется ли уже это расписание
+            logger.error("❌ Критическая ошибка при проверке расписаний: %s", e, exc_info=True)
+
+    def _try_admit(self, schedule_id):
+        """Пометить расписание выполняющимся; False — оно уже выполняется"""
         with self.lock:
             if schedule_id in self.running_tasks:
-                print(f"⚠️ Расписание {schedule_id} уже выполняется, пропускаем дублирующий запуск")
-                return
+                logger.warning("⚠️ Расписание %s уже выполняется, пропускаем дублирующий запуск", schedule_id)
+                return False
             self.running_tasks.add(schedule_id)
             # Инициализируем прогресс
-            self.task_progress[schedule_id] = {
-                'status': 'running',
-                'progress': 0,
-                'processed_files': 0,
-                'total_files': 0,
-                'current_file': '',
-                'message': 'Подготовка...',
-                'start_time': time.time(),
-                'output_file': None
-            }
-        
+            self.task_progress.pop(schedule_id, None)
+            self._evict_progress()
+            self.task_progress[schedule_id] = TaskProgress(start_time=time.time())
+            return True
+
+    def _evict_progress(self):
+        """Освободить место под новую запись прогресса (вызывается под self.lock).
+
+        Сначала вытесняются самые старые завершённые записи, затем — самые старые
+        вообще: записи, которые не дошли до уборщика (упавший поток и т.п.), не копятся.
+        """
+        excess = len(self.task_progress) - self.max_progress_entries + 1
+        if excess <= 0:
+            return
+        snapshot = list(self.task_progress.items())
+        finished = [sid for sid, p in snapshot if p.status in ('completed', 'error')]
+        others = [sid for sid, p in snapshot if p.status not in ('completed', 'error')]
+        for sid in (finished + others)[:excess]:
+            self.task_progress.pop(sid, None)
+
+    def _publish_progress(self, schedule_id, **fields):
+        """Обновить поля прогресса на месте.
+
+        Пишет в запись только поток своего расписания, поэтому общий lock не нужен;
+        self.lock остаётся для вставки/удаления записей.
+        """
+        current = self.task_progress.get(schedule_id)
+        if current is not None:
+            for name, value in fields.items():
+                setattr(current, name, value)
+
+    def _run_in_worker(self, schedule):
+        """Выполнение расписания в потоке пула (со своим контекстом приложения)"""
+        try:
+            if self.flask_app is not None:
+                with self.flask_app.app_context():
+                    self._run_scheduled_classification(schedule, advance_next_run=False)
+            else:
+                self._run_scheduled_classification(schedule, advance_next_run=False)
+        except Exception as e:
+            logger.error("❌ Ошибка при выполнении расписания %s: %s", schedule['name'], e, exc_info=True)
+
+    def _run_scheduled_classification(self, schedule, advance_next_run=True):
+        """Выполнить запланированную классификацию (расписание уже принято через _try_admit).
+
+        advance_next_run=False — next_run уже перенесён при постановке в очередь.
+        """
+        schedule_id = schedule['id']
+        now = datetime.now()
+
         try:
             input_folder = schedule['input_folder']
             context_days = schedule['context_days']
             
             # СРАЗУ обновляем время следующего запуска, чтобы избежать повторного выполнения
-            self.rules_manager.update_next_run(schedule_id)
+            if advance_next_run:
+                self.rules_manager.update_next_run(
+                    schedule_id, schedule.get('schedule_type'), schedule.get('schedule_config')
+                )
             
-            # Генерируем имя выходного файла
-            now = datetime.now()
-            date_str = now.strftime("%d%m%Y_%H%M")
+            # Генерируем имя выходного файла (формат %d%m%Y_%H%M)
+            date_str = f"{now.day:02d}{now.month:02d}{now.year:04d}_{now.hour:02d}{now.minute:02d}"
             output_file = f"call_classification_results_scheduled_{schedule_id}_{date_str}.xlsx"
             output_path = os.path.join(self.upload_folder, output_file)
             
@@ -133,76 +315,82 @@ class ClassificationScheduler:
                 try:
                     # Читаем конфигурацию расписания, чтобы понять режим дня
                     rules = self.rules_manager
-                    # Получаем полное расписание для доступа к schedule_config
-                    full_schedule = rules.get_schedule(schedule_id)
-                    config_json = full_schedule.get('schedule_config') if full_schedule else None
+                    # Конфиг уже пришёл вместе с расписанием: разбирается через кэш, без запроса в БД
+                    cfg = rules.get_schedule_config(schedule_id, schedule.get('schedule_config')) or {}
                     dynamic_mode = 'today'
                     offset_days = 0
-                    if config_json:
-                        import json as _json
-                        try:
-                            cfg = _json.loads(config_json)
-                            dynamic = cfg.get('dynamic_day', {})
-                            dynamic_mode = dynamic.get('mode', 'today')
-                            offset_days = int(dynamic.get('offset_days', 0))
-                        except Exception:
-                            pass
+                    try:
+                        dynamic = cfg.get('dynamic_day', {})
+                        dynamic_mode = dynamic.get('mode', 'today')
+                        offset_days = int(dynamic.get('offset_days', 0))
+                    except Exception:
+                        pass
 
                     from datetime import timedelta
                     base_path = rules.get_setting('transcript_base_path', 'D:\\CallRecords')
-                    run_date = datetime.now()
+                    run_date = now
                     if dynamic_mode == 'offset':
                         run_date = run_date - timedelta(days=offset_days)
                     # Формируем путь E:\\CallRecords\\YYYY\\MM\\DD\\transcript
-                    year = run_date.strftime('%Y')
-                    month = run_date.strftime('%m')
-                    day = run_date.strftime('%d')
-                    input_folder = os.path.join(base_path, year, month, day, 'transcript')
+                    input_folder = os.path.join(
+                        base_path,
+                        f"{run_date.year:04d}",
+                        f"{run_date.month:02d}",
+                        f"{run_date.day:02d}",
+                        'transcript',
+                    )
                 except Exception as e:
-                    print(f"Ошибка вычисления динамической папки для расписания {schedule['name']}: {e}")
+                    logger.error("Ошибка вычисления динамической папки для расписания %s: %s", schedule['name'], e)
                     return
             
-            # Проверяем существование папки
-            if not os.path.exists(input_folder):
-                error_msg = f"Папка {input_folder} не найдена для расписания {schedule['name']}"
-                print(f"⚠️ {error_msg}")
-                logger.warning(error_msg)
+            # Проверяем существование папки и сразу перечисляем файлы одним проходом scandir
+            try:
+                with os.scandir(input_folder) as entries:
+                    text_files = [e.name for e in entries if e.name.endswith('.txt') and e.is_file()]
+            except (FileNotFoundError, NotADirectoryError):
+                logger.warning("⚠️ Папка %s не найдена для расписания %s", input_folder, schedule['name'])
                 # Не обновляем статистику как ошибку, так как папка может появиться позже
                 # Просто пропускаем выполнение
                 return
             
             # Запускаем классификацию
-            logger.info(f"📂 Обработка папки: {input_folder}")
-            logger.info(f"📄 Выходной файл: {output_path}")
-            logger.info(f"📅 Контекст (дней): {context_days}")
-            print(f"📂 Обработка папки: {input_folder}")
-            print(f"📄 Выходной файл: {output_path}")
-            print(f"📅 Контекст (дней): {context_days}")
+            logger.info("📂 Обработка папки: %s", input_folder)
+            logger.info("📄 Выходной файл: %s", output_path)
+            logger.info("📅 Контекст (дней): %s", context_days)
             
             # Функция обратного вызова для обновления прогресса
+            # Прогресс публикуется не чаще раза в 0.5 с или 25 файлов (и всегда на последнем файле)
+            last_update = [0.0, 0]
+
             def progress_callback(processed, total, current_file):
-                with self.lock:
-                    if schedule_id in self.task_progress:
-                        progress = int((processed / total) * 100) if total > 0 else 0
-                        self.task_progress[schedule_id].update({
-                            'progress': progress,
-                            'processed_files': processed,
-                            'total_files': total,
-                            'current_file': current_file or '',
-                            'message': f'Обработка {processed}/{total} файлов...'
-                        })
+                now_ts = time.monotonic()
+                if (
+                    processed != total
+                    and now_ts - last_update[0] < 0.5
+                    and processed - last_update[1] < 25
+                ):
+                    return
+                last_update[0], last_update[1] = now_ts, processed
+                tp = self.task_progress.get(schedule_id)
+                if tp is None:
+                    return
+                tp.progress = int((processed / total) * 100) if total > 0 else 0
+                tp.processed_files = processed
+                tp.total_files = total
+                tp.current_file = current_file or ''
+                tp.message = f'Обработка {processed}/{total} файлов...'
             
             # Обновляем прогресс - начало обработки
-            with self.lock:
-                if schedule_id in self.task_progress:
-                    self.task_progress[schedule_id]['message'] = 'Загрузка файлов...'
+            self._publish_progress(schedule_id, message='Загрузка файлов...')
             
             try:
                 result = self.classification_engine.process_folder(
                     input_folder=input_folder,
                     output_file=output_path,
                     context_days=context_days,
-                    progress_callback=progress_callback
+                    progress_callback=progress_callback,
+                    files=text_files,
+                    save=False,
                 )
                 
                 # Обрабатываем разные варианты возврата
@@ -218,97 +406,130 @@ class ClassificationScheduler:
                     results = result if result else []
                     total_calls = len(results) if results else 0
                 
-                logger.info(f"✅ Расписание {schedule['name']} выполнено успешно. Обработано {total_calls} звонков")
-                print(f"✅ Расписание {schedule['name']} выполнено успешно. Обработано {total_calls} звонков")
+                # Excel пишется в потоке записи, пока здесь публикуется прогресс;
+                # успех фиксируется в статистике только после сохранения отчёта
+                save_future = self._submit_excel_write(results, output_path)
+                self._publish_progress(schedule_id, message='Сохранение отчёта...')
+                save_future.result()
+                try:
+                    self.rules_manager.update_schedule_run_stats(schedule_id, success=True)
+                    logger.info("Статистика расписания %s обновлена", schedule_id)
+                except Exception as stats_error:
+                    logger.warning("Не удалось обновить статистику: %s", stats_error)
+
+                logger.info("✅ Расписание %s выполнено успешно. Обработано %s звонков", schedule['name'], total_calls)
                 
                 # Обновляем прогресс - завершение
-                with self.lock:
-                    if schedule_id in self.task_progress:
-                        duration = time.time() - self.task_progress[schedule_id]['start_time']
-                        self.task_progress[schedule_id].update({
-                            'status': 'completed',
-                            'progress': 100,
-                            'message': f'Завершено. Обработано {total_calls} звонков',
-                            'duration': f'{int(duration//60)}м {int(duration%60)}с',
-                            'output_file': output_file,
-                            'total_calls': total_calls
-                        })
+                current = self.task_progress.get(schedule_id)
+                if current is not None:
+                    duration = time.time() - current.start_time
+                    self._publish_progress(
+                        schedule_id,
+                        status='completed',
+                        progress=100,
+                        message=f'Завершено. Обработано {total_calls} звонков',
+                        duration=f'{int(duration//60)}м {int(duration%60)}с',
+                        output_file=output_file,
+                        total_calls=total_calls,
+                    )
             except Exception as proc_error:
-                logger.error(f"❌ Ошибка при обработке папки {input_folder}: {proc_error}")
-                print(f"❌ Ошибка при обработке папки {input_folder}: {proc_error}")
-                import traceback
-                error_trace = traceback.format_exc()
-                logger.error(f"Детали ошибки:\n{error_trace}")
+                logger.error("❌ Ошибка при обработке папки %s: %s", input_folder, proc_error, exc_info=True)
                 
                 # Обновляем прогресс - ошибка
-                with self.lock:
-                    if schedule_id in self.task_progress:
-                        self.task_progress[schedule_id].update({
-                            'status': 'error',
-                            'message': f'Ошибка: {str(proc_error)}',
-                            'error': str(proc_error)
-                        })
-                
-                traceback.print_exc()
+                self._publish_progress(
+                    schedule_id,
+                    status='error',
+                    message=f'Ошибка: {str(proc_error)}',
+                    error=str(proc_error),
+                )
                 raise
             
-            # Обновляем статистику успешного выполнения
+            # Один stat на оба канала отправки; имя файла отчёта — это output_file
             try:
-                self.rules_manager.update_schedule_run_stats(schedule_id, success=True)
-                logger.info(f"Статистика расписания {schedule_id} обновлена")
-            except Exception as stats_error:
-                logger.warning(f"Не удалось обновить статистику: {stats_error}")
+                os.stat(output_path)
+                report_exists = True
+            except OSError:
+                report_exists = False
+            report_caption = f'Запланированный отчет: {output_file} ({total_calls} звонков)'
 
             # Попытка отправить файл в Telegram, если включено
             try:
                 telegram_enabled = self.rules_manager.get_setting('telegram_enabled', '0') == '1'
                 bot_token = self.rules_manager.get_setting('telegram_bot_token', '')
                 chat_id = self.rules_manager.get_setting('telegram_chat_id', '')
-                if telegram_enabled and bot_token and chat_id and os.path.exists(output_path):
+                if telegram_enabled and bot_token and chat_id and report_exists:
                     url = f'https://api.telegram.org/bot{bot_token}/sendDocument'
-                    with open(output_path, 'rb') as f:
-                        files = {'document': (os.path.basename(output_path), f, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')}
-                        data = {'chat_id': chat_id, 'caption': f'Запланированный отчет: {os.path.basename(output_path)} ({total_calls} звонков)'}
-                        requests.post(url, data=data, files=files, timeout=30)
+                    fields = {'chat_id': chat_id, 'caption': report_caption}
+                    with _MultipartFileBody(fields, 'document', output_path, XLSX_MIME) as body:
+                        _http.post(url, data=body, headers={'Content-Type': body.content_type}, timeout=30)
             except Exception as te:
-                print(f"Ошибка отправки отчета в Telegram: {te}")
+                logger.warning("Ошибка отправки отчета в Telegram: %s", te)
 
             # Отправка в MAX (Bot API), если включено — тот же сценарий, что и Excel в Telegram
             try:
                 max_enabled = self.rules_manager.get_setting('max_enabled', '0') == '1'
                 max_token = (self.rules_manager.get_setting('max_access_token', '') or '').strip()
                 max_chat = (self.rules_manager.get_setting('max_chat_id', '') or '').strip()
-                max_caption = (
-                    f'Запланированный отчет: {os.path.basename(output_path)} ({total_calls} звонков)'
-                )
-                if max_enabled and max_token and max_chat and os.path.exists(output_path):
-                    send_excel_report_to_max(max_token, max_chat, output_path, max_caption)
+                if max_enabled and max_token and max_chat and report_exists:
+                    send_excel_report_to_max(max_token, max_chat, output_path, report_caption)
             except Exception as me:
                 logger.warning("Ошибка отправки отчета в MAX: %s", me)
-                print(f"Ошибка отправки отчета в MAX: {me}")
                 
         except Exception as e:
-            print(f"Ошибка при выполнении классификации для расписания {schedule['name']}: {e}")
+            logger.error("Ошибка при выполнении классификации для расписания %s: %s", schedule['name'], e)
             self.rules_manager.update_schedule_run_stats(schedule_id, success=False)
         finally:
-            # Убираем задачу из списка выполняемых через 60 секунд после завершения
+            # Убираем задачу из списка выполняемых через progress_ttl секунд после завершения
             # (чтобы можно было получить статус)
-            def cleanup_progress():
-                time.sleep(60)  # Храним прогресс 60 секунд после завершения
-                with self.lock:
-                    self.running_tasks.discard(schedule_id)
-                    if schedule_id in self.task_progress:
-                        # Удаляем прогресс только если статус не active
-                        if self.task_progress[schedule_id].get('status') in ('completed', 'error'):
-                            del self.task_progress[schedule_id]
-            
-            cleanup_thread = threading.Thread(target=cleanup_progress, daemon=True)
-            cleanup_thread.start()
+            self._schedule_cleanup(schedule_id)
+
+    def _submit_excel_write(self, results, output_path):
+        """Отдать сохранение отчёта потоку записи; возвращает Future"""
+        with self.lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cls-sched-xlsx')
+            writer = self._writer
+        self._writer_slots.acquire()
+        try:
+            future = writer.submit(self.classification_engine.save_results_to_excel, results, output_path)
+        except Exception:
+            self._writer_slots.release()
+            raise
+        future.add_done_callback(lambda _f: self._writer_slots.release())
+        return future
+
+    def _schedule_cleanup(self, schedule_id):
+        """Поставить расписание в очередь отложенной очистки; один поток-уборщик на все расписания"""
+        with self._cleanup_cond:
+            heapq.heappush(self._cleanup_heap, (time.monotonic() + self.progress_ttl, schedule_id))
+            self._cleanup_cond.notify()
+            if self._reaper_thread is None:
+                self._reaper_thread = threading.Thread(
+                    target=self._reaper_loop, name='cls-sched-reaper', daemon=True
+                )
+                self._reaper_thread.start()
+
+    def _reaper_loop(self):
+        """Снимать записи с истёкшим сроком; поток завершается, когда очередь пуста"""
+        with self._cleanup_cond:
+            while self._cleanup_heap:
+                expire, schedule_id = self._cleanup_heap[0]
+                delay = expire - time.monotonic()
+                if delay > 0:
+                    self._cleanup_cond.wait(timeout=delay)
+                    continue
+                heapq.heappop(self._cleanup_heap)
+                self.running_tasks.discard(schedule_id)
+                # Удаляем прогресс только если статус не active
+                progress = self.task_progress.get(schedule_id)
+                if progress is not None and progress.status in ('completed', 'error'):
+                    del self.task_progress[schedule_id]
+            self._reaper_thread = None
     
     def get_task_progress(self, schedule_id):
-        """Получить прогресс выполнения расписания"""
-        with self.lock:
-            return self.task_progress.get(schedule_id, None)
+        """Получить прогресс выполнения расписания (словарь-снимок TaskProgress или None)"""
+        progress = self.task_progress.get(schedule_id)
+        return asdict(progress) if progress is not None else None
     
     def run_schedule_now(self, schedule_id):
         """Запустить расписание немедленно"""
@@ -320,30 +541,33 @@ class ClassificationScheduler:
             if not schedule.get('is_active', False):
                 raise ValueError(f"Расписание {schedule['name']} неактивно")
             
-            logger.info(f"🚀 Запуск расписания вручную: {schedule['name']} (ID: {schedule_id})")
-            print(f"🚀 Запуск расписания вручную: {schedule['name']} (ID: {schedule_id})")
+            logger.info("🚀 Запуск расписания вручную: %s (ID: %s)", schedule['name'], schedule_id)
             
             # Проверяем структуру расписания
-            logger.info(f"Структура расписания: input_folder={schedule.get('input_folder')}, context_days={schedule.get('context_days')}")
+            logger.info(
+                "Структура расписания: input_folder=%s, context_days=%s",
+                schedule.get('input_folder'), schedule.get('context_days'),
+            )
             
             # Создаем временную структуру для запуска
             temp_schedule = {
                 'id': schedule_id,
                 'name': schedule['name'],
                 'input_folder': schedule.get('input_folder', '__DYNAMIC__'),
-                'context_days': schedule.get('context_days', 2)
+                'context_days': schedule.get('context_days', 2),
+                'schedule_type': schedule.get('schedule_type'),
+                'schedule_config': schedule.get('schedule_config'),
             }
             
-            logger.info(f"Запуск с параметрами: {temp_schedule}")
+            logger.info("Запуск с параметрами: %s", temp_schedule)
+            if not self._try_admit(schedule_id):
+                return
             self._run_scheduled_classification(temp_schedule)
-            logger.info(f"✅ Расписание {schedule['name']} успешно завершено")
-            print(f"✅ Расписание {schedule['name']} успешно завершено")
+            # next_run расписания изменился — цикл пересчитает время ожидания
+            self.wake()
+            logger.info("✅ Расписание %s успешно завершено", schedule['name'])
         except Exception as e:
-            import traceback
-            error_details = traceback.format_exc()
-            logger.error(f"❌ Ошибка при запуске расписания {schedule_id}: {e}\n{error_details}")
-            print(f"❌ Ошибка при запуске расписания {schedule_id}: {e}")
-            traceback.print_exc()
+            logger.error("❌ Ошибка при запуске расписания %s: %s", schedule_id, e, exc_info=True)
             raise
     
     def get_scheduler_status(self):
@@ -351,7 +575,7 @@ class ClassificationScheduler:
         return {
             'running': self.running,
             'check_interval': self.check_interval,
-            'active_schedules': len(self.rules_manager.get_schedules(active_only=True))
+            'active_schedules': len(self.rules_manager.get_schedules_summary(active_only=True))
         }
 
 # Глобальный экземпляр планировщика
@@ -400,7 +624,12 @@ def stop_scheduler():
         scheduler_instance = None
 
 if __name__ == "__main__":
-    # Тестирование планировщика
+    # Тестирование планировщика: сообщения планировщика идут через logging в stdout
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(name)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
     print("Тестирование планировщика задач...")
     
     scheduler = get_scheduler()
@@ -106,13 +106,14 @@ def run_daily_learning_cycle():
         
         log_file = log_dir / f"daily_learning_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         
-        with open(log_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                'timestamp': result.get('timestamp'),
-                'rules_updated': rules_updated,
-                'effectiveness': effectiveness,
-                'report': report
-            }, f, ensure_ascii=False, indent=2, default=str)
+        # json.dumps + одна запись вместо множества мелких write() из json.dump
+        payload = json.dumps({
+            'timestamp': result.get('timestamp'),
+            'rules_updated': rules_updated,
+            'effectiveness': effectiveness,
+            'report': report
+        }, ensure_ascii=False, indent=2, default=str)
+        log_file.write_text(payload, encoding='utf-8')
         
         print()
         print(f"Отчет сохранен в: {log_file}")
@@ -7,13 +7,24 @@
 from __future__ import annotations
 
 import hashlib
+import heapq
 import json
+import logging
 import os
 import re
-from collections import Counter, defaultdict
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 
+from flask import current_app
+from sqlalchemy import case, cast, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from classification_module.classification_rules import invalidate_rules_cache
 from database.models import (
     UserAutoExtractedRule,
     UserClassificationSuccessStat,
@@ -25,6 +36,65 @@ from database.models import (
     db,
 )
 
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\b[а-яё]{4,}\b")
+_STOP_WORDS = frozenset(
+    {
+        "это", "что", "как", "так", "для", "или", "если", "но", "да", "нет", "он", "она",
+        "они", "мы", "вы", "меня", "тебя", "его", "её", "быть", "был", "была", "было",
+        "были", "в", "на", "с", "по", "от", "до", "из", "за", "под", "над", "к", "о", "об",
+        "со", "во", "при",
+    }
+)
+
+
+def _to_json(value: Any) -> str:
+    """Компактный JSON для списков паттернов (без пробелов после разделителей)."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+_ANALYSIS_MEMO_TTL = 60.0
+
+
+def _in_app_context(app: Any, fn):
+    with app.app_context():
+        try:
+            return fn()
+        finally:
+            db.session.remove()
+
+# Ключевые слова обучающих примеров по transcription_hash: текст примера не меняется после вставки
+_KeywordSet = Tuple[FrozenSet[str], int]
+_EXAMPLE_KEYWORDS_MAX = 4096
+_example_keywords: "OrderedDict[str, _KeywordSet]" = OrderedDict()
+_example_keywords_lock = threading.Lock()
+
+
+def _keyword_mask(words) -> int:
+    """64-битная маска слов: пустое пересечение масок гарантирует пустое пересечение слов."""
+    mask = 0
+    for word in words:
+        mask |= 1 << (hash(word) & 63)
+    return mask
+
+
+def _keyword_set(words) -> _KeywordSet:
+    keywords = frozenset(words)
+    return keywords, _keyword_mask(keywords)
+
+
+@lru_cache(maxsize=4096)
+def _extract_keywords(text: str) -> Tuple[str, ...]:
+    """Ключевые слова транскрипции (топ-15); кэшируется по тексту."""
+    word_counts: Counter = Counter()
+    for word in _WORD_RE.findall(text.lower()):
+        if word not in _STOP_WORDS:
+            word_counts[word] += 1
+    if len(word_counts) <= 15:
+        return tuple(sorted(word_counts, key=word_counts.__getitem__, reverse=True))
+    return tuple(word for word, count in word_counts.most_common(15))
+
 
 class SelfLearningSystem:
     """Система автоматического самообучения с подтверждениями"""
@@ -39,6 +109,7 @@ class SelfLearningSystem:
                 "SelfLearningSystem требует user_id=... или CLASSIFICATION_USER_ID"
             )
         self.user_id = int(uid)
+        self._analysis_memo: Dict[Tuple[str, int], Tuple[Any, float, Any]] = {}
 
     def init_learning_tables(self) -> None:
         """Схема создаётся в PostgreSQL (db.create_all / миграции)."""
@@ -47,6 +118,12 @@ class SelfLearningSystem:
     def init_rules_tables(self) -> None:
         pass
 
+    @staticmethod
+    def _commit_relaxed() -> None:
+        """Коммит производной статистики без ожидания fsync WAL (synchronous_commit=off)."""
+        db.session.execute(text("SET LOCAL synchronous_commit TO OFF"))
+        db.session.commit()
+
     def mark_as_correct(
         self,
         phone_number: str,
@@ -59,104 +136,91 @@ class SelfLearningSystem:
         confidence_level: int = 5,
         comment: str = "",
     ) -> bool:
-        import logging
-
-        logger = logging.getLogger(__name__)
         try:
-            transcription_hash = hashlib.md5(transcription.encode("utf-8")).hexdigest()
-            existing = (
-                UserCorrectClassification.query.filter_by(
-                    user_id=self.user_id,
-                    phone_number=phone_number,
-                    call_date=call_date,
-                    call_time=call_time,
-                )
-                .first()
-            )
-            if existing:
-                existing.category = category
-                existing.reasoning = reasoning
-                existing.transcription_hash = transcription_hash
-                existing.confidence_level = int(confidence_level)
-                existing.comment = comment or ""
-                existing.confirmed_by = confirmed_by
-                existing.confirmed_at = datetime.utcnow()
-            else:
+            # Только идентификатор содержимого (нигде не сверяется): blake2b быстрее md5, та же длина
+            transcription_hash = hashlib.blake2b(
+                transcription.encode("utf-8"), digest_size=16
+            ).hexdigest()
+            values = {
+                "category": category,
+                "reasoning": reasoning,
+                "transcription_hash": transcription_hash,
+                "confidence_level": int(confidence_level),
+                "comment": comment or "",
+                "confirmed_by": confirmed_by,
+                "confirmed_at": datetime.utcnow(),
+            }
+            # UPDATE по idx_ucc_user_call вместо SELECT + изменения объекта; INSERT — только для новой записи
+            updated = UserCorrectClassification.query.filter_by(
+                user_id=self.user_id,
+                phone_number=phone_number,
+                call_date=call_date,
+                call_time=call_time,
+            ).update(values, synchronize_session=False)
+            if not updated:
                 db.session.add(
                     UserCorrectClassification(
                         user_id=self.user_id,
                         phone_number=phone_number,
                         call_date=call_date,
                         call_time=call_time,
-                        category=category,
-                        reasoning=reasoning,
-                        transcription_hash=transcription_hash,
-                        confirmed_by=confirmed_by,
-                        confidence_level=int(confidence_level),
-                        comment=comment or "",
+                        **values,
                     )
                 )
+            db.session.flush()
+            # Производные записи — в той же транзакции; сбой одной откатывает только её SAVEPOINT
+            derived = (
+                ("статистики", self._update_category_success_stats, (category, True)),
+                ("паттернов", self._update_success_patterns, (transcription, category, reasoning)),
+                ("эффективности", self._improve_example_effectiveness, (transcription, category)),
+            )
+            for label, update, args in derived:
+                try:
+                    with db.session.begin_nested():
+                        update(*args, commit=False)
+                except Exception as he:
+                    logger.warning("Ошибка при обновлении %s: %s", label, he)
             db.session.commit()
-            try:
-                self._update_category_success_stats(category, is_correct=True)
-            except Exception as se:
-                logger.warning("Ошибка при обновлении статистики: %s", se)
-            try:
-                self._update_success_patterns(transcription, category, reasoning)
-            except Exception as pe:
-                logger.warning("Ошибка при обновлении паттернов: %s", pe)
-            try:
-                self._improve_example_effectiveness(transcription, category)
-            except Exception as ee:
-                logger.warning("Ошибка при обновлении эффективности: %s", ee)
             return True
-        except Exception as e:
-            logger.exception("Ошибка при отметке как правильной: %s", e)
+        except Exception:
             db.session.rollback()
+            logger.exception("Ошибка при отметке как правильной")
             return False
 
-    def _update_category_success_stats(self, category: str, is_correct: bool = True) -> None:
-        row = (
-            UserClassificationSuccessStat.query.filter_by(
-                user_id=self.user_id, category=category
-            )
-            .first()
+    def _update_category_success_stats(
+        self, category: str, is_correct: bool = True, commit: bool = True
+    ) -> None:
+        confirmed = 1 if is_correct else 0
+        now = datetime.utcnow()
+        stats = UserClassificationSuccessStat.__table__
+        stmt = pg_insert(stats).values(
+            user_id=self.user_id,
+            category=category,
+            total_classified=1,
+            confirmed_correct=confirmed,
+            corrections_count=1 - confirmed,
+            success_rate=100.0 * confirmed,
+            last_updated=now,
         )
-        if row:
-            total = int(row.total_classified or 0) + 1
-            confirmed = int(row.confirmed_correct or 0) + (1 if is_correct else 0)
-            corrections = int(row.corrections_count or 0) + (0 if is_correct else 1)
-            row.total_classified = total
-            row.confirmed_correct = confirmed
-            row.corrections_count = corrections
-            row.success_rate = (confirmed / total * 100) if total > 0 else 0.0
-            row.last_updated = datetime.utcnow()
-        else:
-            if is_correct:
-                db.session.add(
-                    UserClassificationSuccessStat(
-                        user_id=self.user_id,
-                        category=category,
-                        total_classified=1,
-                        confirmed_correct=1,
-                        corrections_count=0,
-                        success_rate=100.0,
-                    )
-                )
-            else:
-                db.session.add(
-                    UserClassificationSuccessStat(
-                        user_id=self.user_id,
-                        category=category,
-                        total_classified=1,
-                        confirmed_correct=0,
-                        corrections_count=1,
-                        success_rate=0.0,
-                    )
-                )
-        db.session.commit()
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_user_class_success_category",
+            set_={
+                "total_classified": stats.c.total_classified + 1,
+                "confirmed_correct": stats.c.confirmed_correct + confirmed,
+                "corrections_count": stats.c.corrections_count + (1 - confirmed),
+                "success_rate": 100.0
+                * (stats.c.confirmed_correct + confirmed)
+                / (stats.c.total_classified + 1),
+                "last_updated": now,
+            },
+        )
+        db.session.execute(stmt)
+        if commit:
+            self._commit_relaxed()
 
-    def _update_success_patterns(self, transcription: str, category: str, reasoning: str) -> None:
+    def _update_success_patterns(
+        self, transcription: str, category: str, reasoning: str, commit: bool = True
+    ) -> None:
         keywords = self._extract_keywords_from_text(transcription)
         row = (
             UserSuccessPattern.query.filter_by(
@@ -167,14 +231,16 @@ class SelfLearningSystem:
         )
         if row:
             existing_keywords = json.loads(row.common_keywords) if row.common_keywords else []
-            combined = list(set(existing_keywords + keywords))[:20]
-            samples = json.loads(row.transcription_samples) if row.transcription_samples else []
+            # Список ключевых слов переписывается, только если в него реально добавляется слово
+            new_keywords = set(keywords).difference(existing_keywords)
+            if new_keywords and len(existing_keywords) < 20:
+                combined = existing_keywords + sorted(new_keywords)[: 20 - len(existing_keywords)]
+                row.common_keywords = _to_json(combined)
             sample_text = transcription[:200]
+            samples = json.loads(row.transcription_samples) if row.transcription_samples else []
             if sample_text not in samples:
                 samples.append(sample_text)
-                samples = samples[-10:]
-            row.common_keywords = json.dumps(combined, ensure_ascii=False)
-            row.transcription_samples = json.dumps(samples, ensure_ascii=False)
+                row.transcription_samples = _to_json(samples[-10:])
             row.confirmation_count = int(row.confirmation_count or 0) + 1
             row.last_confirmed = datetime.utcnow()
         else:
@@ -182,101 +248,97 @@ class SelfLearningSystem:
                 UserSuccessPattern(
                     user_id=self.user_id,
                     category=category,
-                    common_keywords=json.dumps(keywords, ensure_ascii=False),
-                    transcription_samples=json.dumps([transcription[:200]], ensure_ascii=False),
+                    common_keywords=_to_json(keywords),
+                    transcription_samples=_to_json([transcription[:200]]),
                     confirmation_count=1,
                 )
             )
-        db.session.commit()
-
-    def _improve_example_effectiveness(self, transcription: str, category: str) -> None:
-        example_ids = [
-            r.id
-            for r in UserTrainingExample.query.filter_by(
-                user_id=self.user_id, correct_category=category, is_active=True
-            ).all()
-        ]
-        transcription_keywords = set(self._extract_keywords_from_text(transcription))
-        for ex_id in example_ids:
-            ex = UserTrainingExample.query.filter_by(
-                user_id=self.user_id, id=ex_id
-            ).first()
-            if not ex:
+        if commit:
+            self._commit_relaxed()
+
+    def _improve_example_effectiveness(
+        self, transcription: str, category: str, commit: bool = True
+    ) -> None:
+        transcription_keywords = frozenset(self._extract_keywords_from_text(transcription))
+        t_mask = _keyword_mask(transcription_keywords)
+        t_len = len(transcription_keywords)
+        similar_ids = []
+        for ex_id, (ex_keywords, ex_mask) in self._example_keyword_sets(category):
+            # Точные отсечения до Жаккара: без общих битов нет общих слов, а J <= min/max размеров
+            if not t_mask & ex_mask:
+                continue
+            small, big = sorted((t_len, len(ex_keywords)))
+            if small <= 0.3 * big:
                 continue
-            ex_keywords = set(self._extract_keywords_from_text(ex.transcription))
             similarity = len(transcription_keywords & ex_keywords) / max(
                 len(transcription_keywords | ex_keywords), 1
             )
-            if similarity <= 0.3:
-                continue
-            eff = UserExampleEffectiveness.query.filter_by(
-                user_id=self.user_id, example_id=ex_id
-            ).first()
-            if eff:
-                tc = int(eff.times_confirmed or 0) + 1
-                eff.times_confirmed = tc
-                tu = max(int(eff.times_used or 0), 1)
-                eff.success_rate = tc / tu
-                eff.last_used = datetime.utcnow()
-            else:
-                db.session.add(
-                    UserExampleEffectiveness(
-                        user_id=self.user_id,
-                        example_id=ex_id,
-                        times_confirmed=1,
-                        success_rate=1.0,
-                        last_used=datetime.utcnow(),
-                    )
-                )
-        db.session.commit()
+            if similarity > 0.3:
+                similar_ids.append(ex_id)
+        if similar_ids:
+            now = datetime.utcnow()
+            eff = UserExampleEffectiveness.__table__
+            stmt = pg_insert(eff).values(
+                [
+                    {
+                        "user_id": self.user_id,
+                        "example_id": ex_id,
+                        "times_used": 0,
+                        "times_helped": 0,
+                        "times_misled": 0,
+                        "times_confirmed": 1,
+                        "success_rate": 1.0,
+                        "last_used": now,
+                    }
+                    for ex_id in similar_ids
+                ]
+            )
+            stmt = stmt.on_conflict_do_update(
+                constraint="uq_user_example_effectiveness",
+                set_={
+                    "times_confirmed": eff.c.times_confirmed + 1,
+                    "success_rate": cast(eff.c.times_confirmed + 1, db.Float)
+                    / func.greatest(eff.c.times_used, 1),
+                    "last_used": now,
+                },
+            )
+            db.session.execute(stmt)
+        if commit:
+            self._commit_relaxed()
 
-    def _extract_keywords_from_text(self, text: str) -> List[str]:
-        stop_words = {
-            "это",
-            "что",
-            "как",
-            "так",
-            "для",
-            "или",
-            "если",
-            "но",
-            "да",
-            "нет",
-            "он",
-            "она",
-            "они",
-            "мы",
-            "вы",
-            "меня",
-            "тебя",
-            "его",
-            "её",
-            "быть",
-            "был",
-            "была",
-            "было",
-            "были",
-            "в",
-            "на",
-            "с",
-            "по",
-            "от",
-            "до",
-            "из",
-            "за",
-            "под",
-            "над",
-            "к",
-            "о",
-            "об",
-            "со",
-            "во",
-            "при",
-        }
-        words = re.findall(r"\b[а-яё]{4,}\b", text.lower())
-        keywords = [w for w in words if w not in stop_words]
-        word_counts = Counter(keywords)
-        return [word for word, count in word_counts.most_common(15)]
+    def _example_keyword_sets(self, category: str) -> List[Tuple[int, _KeywordSet]]:
+        """Ключевые слова активных примеров категории; тексты читаются только для новых хэшей."""
+        rows = (
+            UserTrainingExample.query.with_entities(
+                UserTrainingExample.id, UserTrainingExample.transcription_hash
+            )
+            .filter_by(user_id=self.user_id, correct_category=category, is_active=True)
+            .all()
+        )
+        known: Dict[str, _KeywordSet] = {}
+        with _example_keywords_lock:
+            for _, h in rows:
+                if h in _example_keywords:
+                    _example_keywords.move_to_end(h)
+                    known[h] = _example_keywords[h]
+        missing_ids = [ex_id for ex_id, h in rows if h not in known]
+        if missing_ids:
+            fetched = {
+                h: _keyword_set(_extract_keywords(text or ""))
+                for h, text in UserTrainingExample.query.with_entities(
+                    UserTrainingExample.transcription_hash, UserTrainingExample.transcription
+                ).filter(UserTrainingExample.id.in_(missing_ids))
+            }
+            with _example_keywords_lock:
+                for h, keywords in fetched.items():
+                    _example_keywords[h] = keywords
+                while len(_example_keywords) > _EXAMPLE_KEYWORDS_MAX:
+                    _example_keywords.popitem(last=False)
+            known.update(fetched)
+        return [(ex_id, known[h]) for ex_id, h in rows if h in known]
+
+    def _extract_keywords_from_text(self, text: str) -> Tuple[str, ...]:
+        return _extract_keywords(text)
 
     def get_category_success_stats(self) -> Dict[str, Dict]:
         rows = UserClassificationSuccessStat.query.filter_by(user_id=self.user_id).all()
@@ -315,43 +377,37 @@ class SelfLearningSystem:
         return patterns
 
     def analyze_learning_progress(self, days: int = 30) -> Dict:
-        since = datetime.utcnow() - timedelta(days=days)
-        prev_since = datetime.utcnow() - timedelta(days=days * 2)
-
-        from sqlalchemy import func
-
-        confirmations = db.session.query(
-            func.count(UserCorrectClassification.id),
-            func.count(func.distinct(UserCorrectClassification.category)),
-            func.avg(UserCorrectClassification.confidence_level),
-        ).filter(
-            UserCorrectClassification.user_id == self.user_id,
-            UserCorrectClassification.confirmed_at >= since,
-        ).first()
-
-        corrections = (
-            UserCorrectionHistory.query.filter(
-                UserCorrectionHistory.user_id == self.user_id,
-                UserCorrectionHistory.correction_date >= since,
+        now = datetime.utcnow()
+        since = now - timedelta(days=days)
+        prev_since = now - timedelta(days=days * 2)
+
+        # Текущий и предыдущий периоды — за один проход по каждой таблице
+        ucc = UserCorrectClassification
+        in_current = ucc.confirmed_at >= since
+        confirmations = (
+            db.session.query(
+                func.count(case((in_current, ucc.id))),
+                func.count(func.distinct(case((in_current, ucc.category)))),
+                func.avg(case((in_current, ucc.confidence_level))),
+                func.count(case((ucc.confirmed_at < since, ucc.id))),
             )
-            .count()
+            .filter(ucc.user_id == self.user_id, ucc.confirmed_at >= prev_since)
+            .first()
         )
+        uch = UserCorrectionHistory
+        corrections_row = (
+            db.session.query(
+                func.count(case((uch.correction_date >= since, uch.id))),
+                func.count(case((uch.correction_date < since, uch.id))),
+            )
+            .filter(uch.user_id == self.user_id, uch.correction_date >= prev_since)
+            .first()
+        )
+        corrections = int(corrections_row[0] or 0) if corrections_row else 0
+        prev_corrections = int(corrections_row[1] or 0) if corrections_row else 0
         total_confirmations = int(confirmations[0] or 0) if confirmations else 0
+        prev_confirmations = int(confirmations[3] or 0) if confirmations else 0
         total_interactions = total_confirmations + corrections
-        prev_confirmations = (
-            UserCorrectClassification.query.filter(
-                UserCorrectClassification.user_id == self.user_id,
-                UserCorrectClassification.confirmed_at >= prev_since,
-                UserCorrectClassification.confirmed_at < since,
-            ).count()
-        )
-        prev_corrections = (
-            UserCorrectionHistory.query.filter(
-                UserCorrectionHistory.user_id == self.user_id,
-                UserCorrectionHistory.correction_date >= prev_since,
-                UserCorrectionHistory.correction_date < since,
-            ).count()
-        )
         prev_total = prev_confirmations + prev_corrections
         current_accuracy = (
             (total_confirmations / total_interactions * 100) if total_interactions > 0 else 0.0
@@ -372,15 +428,51 @@ class SelfLearningSystem:
             "avg_confidence": float(confirmations[2] or 0) if confirmations else 0.0,
         }
 
-    def analyze_error_patterns(self, days: int = 30) -> List[Dict]:
+    def _memoized(self, key: Tuple[str, int], compute):
+        """Результат анализа корректировок, пока не появилась новая корректировка (и не дольше TTL)."""
+        stamp = (
+            db.session.query(func.max(UserCorrectionHistory.correction_date))
+            .filter(UserCorrectionHistory.user_id == self.user_id)
+            .scalar()
+        )
+        now = time.monotonic()
+        hit = self._analysis_memo.get(key)
+        if hit is not None and hit[0] == stamp and now - hit[1] < _ANALYSIS_MEMO_TTL:
+            return hit[2]
+        value = compute()
+        self._analysis_memo[key] = (stamp, now, value)
+        return value
+
+    def invalidate_analysis_cache(self) -> None:
+        self._analysis_memo.clear()
+
+    def _recent_corrections(self, days: int) -> List[Any]:
+        return self._memoized(("rows", days), lambda: self._fetch_corrections(days))
+
+    def _fetch_corrections(self, days: int) -> List[Any]:
         since = datetime.utcnow() - timedelta(days=days)
-        rows = (
-            UserCorrectionHistory.query.filter(
+        return (
+            UserCorrectionHistory.query.with_entities(
+                UserCorrectionHistory.original_category,
+                UserCorrectionHistory.corrected_category,
+                UserCorrectionHistory.original_reasoning,
+                UserCorrectionHistory.corrected_reasoning,
+                UserCorrectionHistory.correction_date,
+            )
+            .filter(
                 UserCorrectionHistory.user_id == self.user_id,
                 UserCorrectionHistory.correction_date >= since,
             )
             .all()
         )
+
+    def analyze_error_patterns(self, days: int = 30) -> List[Dict]:
+        return self._memoized(
+            ("patterns", days),
+            lambda: self._error_patterns_from_rows(self._recent_corrections(days)),
+        )
+
+    def _error_patterns_from_rows(self, rows: List[Any]) -> List[Dict]:
         error_transitions = defaultdict(list)
         for c in rows:
             key = f"{c.original_category}→{c.corrected_category}"
@@ -416,7 +508,7 @@ class SelfLearningSystem:
     def _find_common_keywords(self, texts: List[str]) -> List[str]:
         all_words: List[str] = []
         for text in texts:
-            words = re.findall(r"\b[а-яё]{4,}\b", (text or "").lower())
+            words = _WORD_RE.findall((text or "").lower())
             all_words.extend(words)
         word_counts = Counter(all_words)
         threshold = len(texts) * 0.5
@@ -425,14 +517,30 @@ class SelfLearningSystem:
         common = [word for word, count in word_counts.items() if count >= threshold]
         return common[:10]
 
-    def auto_update_rules(self, min_confidence: float = 0.7) -> int:
-        patterns = self.analyze_error_patterns(days=30)
-        updated = 0
+    def auto_update_rules(self, min_confidence: float = 0.7, commit: bool = True) -> int:
+        patterns = [
+            p
+            for p in self.analyze_error_patterns(days=30)
+            if p["confidence"] >= min_confidence
+        ]
+        if not patterns:
+            return 0
+        # Все уже извлечённые правила по нужным категориям — одним запросом вместо LIKE на паттерн
+        existing: Dict[str, List[str]] = defaultdict(list)
+        for category_id, rule_text in UserAutoExtractedRule.query.with_entities(
+            UserAutoExtractedRule.category_id, UserAutoExtractedRule.rule_text
+        ).filter(
+            UserAutoExtractedRule.user_id == self.user_id,
+            UserAutoExtractedRule.category_id.in_(list({p["original_category"] for p in patterns})),
+        ):
+            existing[category_id].append(rule_text or "")
+        new_rules = []
         for pattern in patterns:
-            if pattern["confidence"] < min_confidence:
-                continue
             orig_cat = pattern["original_category"]
             corr_cat = pattern["corrected_category"]
+            transition = f"{orig_cat}→{corr_cat}"
+            if any(transition in text for text in existing[orig_cat]):
+                continue
             keywords = pattern["common_keywords"]
             if keywords:
                 rule_text = (
@@ -444,29 +552,24 @@ class SelfLearningSystem:
                     f"ПАТТЕРН ОШИБКИ: Частая ошибка {orig_cat}→{corr_cat}. "
                     f"Проверяй внимательнее эту категорию."
                 )
-            like_part = f"%{orig_cat}→{corr_cat}%"
-            exists = (
-                UserAutoExtractedRule.query.filter(
-                    UserAutoExtractedRule.user_id == self.user_id,
-                    UserAutoExtractedRule.category_id == orig_cat,
-                    UserAutoExtractedRule.rule_text.like(like_part),
+            new_rules.append(
+                UserAutoExtractedRule(
+                    user_id=self.user_id,
+                    rule_text=rule_text,
+                    category_id=orig_cat,
+                    confidence=pattern["confidence"],
+                    source_type="error_pattern",
+                    example_count=pattern["frequency"],
+                    is_active=True,
                 )
-                .first()
             )
-            if not exists:
-                db.session.add(
-                    UserAutoExtractedRule(
-                        user_id=self.user_id,
-                        rule_text=rule_text,
-                        category_id=orig_cat,
-                        confidence=pattern["confidence"],
-                        source_type="error_pattern",
-                        example_count=pattern["frequency"],
-                        is_active=True,
-                    )
-                )
-                updated += 1
-        db.session.commit()
+        updated = len(new_rules)
+        if new_rules:
+            db.session.add_all(new_rules)
+        if commit:
+            db.session.commit()
+            if updated:
+                invalidate_rules_cache(self.user_id)
         return updated
 
     def analyze_example_effectiveness(self) -> Dict:
@@ -518,8 +621,11 @@ class SelfLearningSystem:
             "ineffective_examples": ineffective_examples[:10],
         }
 
-    def suggest_example_improvements(self) -> List[Dict]:
-        effectiveness = self.analyze_example_effectiveness()
+    def suggest_example_improvements(
+        self, effectiveness: Optional[Dict] = None, recent_patterns: Optional[List[Dict]] = None
+    ) -> List[Dict]:
+        if effectiveness is None:
+            effectiveness = self.analyze_example_effectiveness()
         suggestions: List[Dict] = []
         for ex in effectiveness["ineffective_examples"]:
             suggestions.append(
@@ -530,7 +636,9 @@ class SelfLearningSystem:
                     "priority": "high",
                 }
             )
-        patterns = self.analyze_error_patterns(days=7)
+        patterns = (
+            recent_patterns if recent_patterns is not None else self.analyze_error_patterns(days=7)
+        )
         for pattern in patterns[:5]:
             if pattern["frequency"] >= 3:
                 suggestions.append(
@@ -546,33 +654,32 @@ class SelfLearningSystem:
 
     def learn_from_successful_classifications(self, min_count: int = 5) -> List[Dict]:
         since = datetime.utcnow() - timedelta(days=30)
-        from sqlalchemy import func
-
-        q = (
+        ucc = UserCorrectClassification
+        # 10 свежих обоснований на категорию и размер категории — одним запросом с оконными функциями
+        ranked = (
             db.session.query(
-                UserCorrectClassification.category,
-                func.count(UserCorrectClassification.id),
+                ucc.category.label("category"),
+                ucc.reasoning.label("reasoning"),
+                func.row_number()
+                .over(partition_by=ucc.category, order_by=ucc.confirmed_at.desc())
+                .label("rn"),
+                func.count().over(partition_by=ucc.category).label("cnt"),
             )
-            .filter(
-                UserCorrectClassification.user_id == self.user_id,
-                UserCorrectClassification.confirmed_at >= since,
-            )
-            .group_by(UserCorrectClassification.category)
-            .having(func.count(UserCorrectClassification.id) >= min_count)
+            .filter(ucc.user_id == self.user_id, ucc.confirmed_at >= since)
+            .subquery()
+        )
+        rows = (
+            db.session.query(ranked.c.category, ranked.c.reasoning)
+            .filter(ranked.c.rn <= 10, ranked.c.cnt >= min_count)
+            .order_by(ranked.c.category)
             .all()
         )
+        by_category: Dict[str, List[Optional[str]]] = {}
+        for category, reasoning in rows:
+            by_category.setdefault(category, []).append(reasoning)
         successful_patterns: List[Dict] = []
-        for category, _cnt in q:
-            rows = (
-                UserCorrectClassification.query.filter(
-                    UserCorrectClassification.user_id == self.user_id,
-                    UserCorrectClassification.category == category,
-                    UserCorrectClassification.confirmed_at >= since,
-                )
-                .limit(10)
-                .all()
-            )
-            texts = [r.reasoning or "" for r in rows if r.reasoning]
+        for category, reasonings in by_category.items():
+            texts = [r for r in reasonings if r]
             if not texts:
                 continue
             common_words = self._find_common_keywords(texts)
@@ -580,16 +687,22 @@ class SelfLearningSystem:
                 {
                     "category": category,
                     "common_keywords": common_words,
-                    "example_count": len(rows),
+                    "example_count": len(reasonings),
                     "confidence": 0.9,
                 }
             )
         return successful_patterns
 
     def generate_learning_report(self) -> Dict:
+        # Корректировки за 30 дней читаются один раз; недельные паттерны — их подмножество
         patterns = self.analyze_error_patterns(days=30)
+        corrections = self._recent_corrections(30)
+        week_ago = datetime.utcnow() - timedelta(days=7)
+        week_patterns = self._error_patterns_from_rows(
+            [c for c in corrections if c.correction_date >= week_ago]
+        )
         effectiveness = self.analyze_example_effectiveness()
-        suggestions = self.suggest_example_improvements()
+        suggestions = self.suggest_example_improvements(effectiveness, week_patterns)
         successful = self.learn_from_successful_classifications()
         return {
             "error_patterns": {"total": len(patterns), "top_5": patterns[:5]},
@@ -629,12 +742,18 @@ class SelfLearningSystem:
         return recommendations
 
     def generate_enhanced_learning_report(self) -> Dict:
-        base_report = self.generate_learning_report()
-        success_stats = self.get_category_success_stats()
-        learning_progress = self.analyze_learning_progress()
-        top_categories = sorted(
-            success_stats.items(), key=lambda x: x[1]["success_rate"], reverse=True
-        )[:5]
+        # Статистика и прогресс читают свои таблицы независимо от базового отчёта —
+        # выполняются параллельно, каждый в своём app context (и своей сессии из пула)
+        app = current_app._get_current_object()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            stats_future = pool.submit(_in_app_context, app, self.get_category_success_stats)
+            progress_future = pool.submit(_in_app_context, app, self.analyze_learning_progress)
+            base_report = self.generate_learning_report()
+            success_stats = stats_future.result()
+            learning_progress = progress_future.result()
+        top_categories = heapq.nlargest(
+            5, success_stats.items(), key=lambda x: x[1]["success_rate"]
+        )
         problem_categories = [
             (cat, stats)
             for cat, stats in success_stats.items()
@@ -649,12 +768,12 @@ class SelfLearningSystem:
             },
             "learning_progress": learning_progress,
             "recommendations": self._generate_enhanced_recommendations(
-                base_report, success_stats, learning_progress
+                base_report, [cat for cat, _ in problem_categories], learning_progress
             ),
         }
 
     def _generate_enhanced_recommendations(
-        self, base_report: Dict, success_stats: Dict, progress: Dict
+        self, base_report: Dict, problem_cats: List[str], progress: Dict
     ) -> List[str]:
         recommendations = list(base_report.get("recommendations", []))
         if progress.get("accuracy_improvement", 0) > 0:
@@ -672,11 +791,6 @@ class SelfLearningSystem:
                 f"Подтверждено {progress['total_confirmations']} правильных классификаций. "
                 f"Система накапливает знания о успешных паттернах."
             )
-        problem_cats = [
-            cat
-            for cat, stats in success_stats.items()
-            if stats.get("total", 0) >= 5 and stats.get("success_rate", 0) < 70
-        ]
         if problem_cats:
             recommendations.append(
                 f"Категории, требующие внимания: {', '.join(problem_cats[:3])}. "
@@ -687,17 +801,22 @@ class SelfLearningSystem:
     def apply_auto_improvements(self, auto_update: bool = False) -> Dict:
         report = self.generate_learning_report()
         if auto_update:
-            rules_updated = self.auto_update_rules()
+            # Новые правила и деактивация примеров — одной транзакцией
+            rules_updated = self.auto_update_rules(commit=False)
+            weak_ids = [
+                ex["id"]
+                for ex in report["example_effectiveness"]["ineffective_examples"]
+                if ex["score"] < 0.2
+            ]
             deactivated = 0
-            for ex in report["example_effectiveness"]["ineffective_examples"]:
-                if ex["score"] < 0.2:
-                    r = UserTrainingExample.query.filter_by(
-                        user_id=self.user_id, id=ex["id"]
-                    ).first()
-                    if r:
-                        r.is_active = False
-                        deactivated += 1
+            if weak_ids:
+                deactivated = UserTrainingExample.query.filter(
+                    UserTrainingExample.user_id == self.user_id,
+                    UserTrainingExample.id.in_(weak_ids),
+                ).update({"is_active": False}, synchronize_session=False)
             db.session.commit()
+            if rules_updated:
+                invalidate_rules_cache(self.user_id)
             return {
                 "rules_updated": rules_updated,
                 "examples_deactivated": deactivated,
@@ -756,10 +875,13 @@ class IntegratedLearningSystem:
         corr_reason,
         operator_name="",
     ) -> bool:
+        # Пример и статистика — одной транзакцией
         self.training_manager.add_training_example(
-            transcription, corr_cat, corr_reason, orig_cat, orig_reason, operator_name
+            transcription, corr_cat, corr_reason, orig_cat, orig_reason, operator_name, commit=False
         )
-        self.self_learning._update_category_success_stats(orig_cat, is_correct=False)
+        self.self_learning._update_category_success_stats(orig_cat, is_correct=False, commit=False)
+        db.session.commit()
+        self.self_learning.invalidate_analysis_cache()
         patterns = self.self_learning.analyze_error_patterns(days=7)
         recent = [p for p in patterns if p["frequency"] >= 3]
         if recent:
@@ -769,7 +891,8 @@ class IntegratedLearningSystem:
     def daily_learning_cycle(self) -> Dict:
         report = self.self_learning.generate_enhanced_learning_report()
         rules_updated = self.self_learning.auto_update_rules(min_confidence=0.7)
-        effectiveness = self.self_learning.analyze_example_effectiveness()
+        # auto_update_rules не трогает примеры — эффективность из отчёта актуальна
+        effectiveness = report["example_effectiveness"]
         return {
             "report": report,
             "rules_updated": rules_updated,
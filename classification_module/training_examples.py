@@ -6,13 +6,44 @@ from __future__ import annotations
 
 import hashlib
 import os
+import re
 from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import case, func, or_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from database.models import UserClassificationMetric, UserCorrectionHistory, UserTrainingExample, db
 
 
+# Маркеры исхода звонка; порядок задаёт приоритет в get_similar_examples
+_IMPORTANT_WORDS: Tuple[str, ...] = (
+    "запись", "записать", "записывайте", "согласен", "подходит", "отказ", "не нужно",
+    "не интересно", "подумаю", "перезвоню", "дорого", "не по карману", "занято",
+    "нет времени", "не выполняем", "свои запчасти", "мессенджер", "whatsapp", "telegram",
+    "обзвон", "акция", "предложение", "то", "техобслуживание", "переадресация",
+    "другой сервис", "другой адрес",
+)
+_EXAMPLE_COLUMNS = (
+    UserTrainingExample.id,
+    UserTrainingExample.transcription,
+    UserTrainingExample.correct_category,
+    UserTrainingExample.correct_reasoning,
+    UserTrainingExample.original_category,
+    UserTrainingExample.original_reasoning,
+    UserTrainingExample.operator_comment,
+    UserTrainingExample.created_at,
+    UserTrainingExample.used_count,
+    UserTrainingExample.is_active,
+)
+
+# Один проход по тексту; lookahead находит и вложенные вхождения («то» внутри «занято»)
+_IMPORTANT_WORDS_RE = re.compile(
+    "(?=(" + "|".join(re.escape(w) for w in sorted(_IMPORTANT_WORDS, key=len, reverse=True)) + "))"
+)
+
+
 class TrainingExamplesManager:
     """Менеджер обучающих примеров (per user_id)."""
 
@@ -35,6 +66,12 @@ class TrainingExamplesManager:
         if classification_root is not None:
             self._classification_root = Path(classification_root).resolve()
 
+    @staticmethod
+    def _commit_counters() -> None:
+        """Счётчики и дневные метрики не критичны к потере при сбое — коммит без ожидания fsync."""
+        db.session.execute(text("SET LOCAL synchronous_commit TO OFF"))
+        db.session.commit()
+
     def add_training_example(
         self,
         transcription: str,
@@ -43,43 +80,74 @@ class TrainingExamplesManager:
         original_category: str = None,
         original_reasoning: str = None,
         operator_comment: str = None,
+        commit: bool = True,
     ) -> bool:
-        try:
+        row = {
+            "transcription": transcription,
+            "correct_category": correct_category,
+            "correct_reasoning": correct_reasoning,
+            "original_category": original_category,
+            "original_reasoning": original_reasoning,
+            "operator_comment": operator_comment,
+        }
+        return self.add_training_examples_bulk([row], commit=commit) > 0
+
+    def add_training_examples_bulk(self, rows: List[Dict], commit: bool = True) -> int:
+        """Upsert пачки примеров одним INSERT ... ON CONFLICT; возвращает число записей."""
+        now = datetime.utcnow()
+        values: Dict[str, Dict] = {}
+        for row in rows:
+            transcription = row["transcription"]
             transcription_hash = hashlib.md5(transcription.encode("utf-8")).hexdigest()
-            ex = (
-                UserTrainingExample.query.filter_by(
-                    user_id=self.user_id, transcription_hash=transcription_hash
-                )
-                .first()
+            # Повтор текста в пачке: побеждает последний, как при последовательных вызовах
+            values[transcription_hash] = {
+                "user_id": self.user_id,
+                "transcription_hash": transcription_hash,
+                "transcription": transcription,
+                "correct_category": row["correct_category"],
+                "correct_reasoning": row["correct_reasoning"],
+                "original_category": row.get("original_category"),
+                "original_reasoning": row.get("original_reasoning"),
+                "operator_comment": row.get("operator_comment"),
+                "created_at": now,
+                "used_count": 0,
+                "is_active": True,
+            }
+        if not values:
+            return 0
+        try:
+            stmt = pg_insert(UserTrainingExample.__table__).values(list(values.values()))
+            stmt = stmt.on_conflict_do_update(
+                constraint="uq_user_training_example_hash",
+                set_={
+                    name: stmt.excluded[name]
+                    for name in (
+                        "correct_category",
+                        "correct_reasoning",
+                        "original_category",
+                        "original_reasoning",
+                        "operator_comment",
+                        "created_at",
+                    )
+                },
             )
-            if ex:
-                ex.correct_category = correct_category
-                ex.correct_reasoning = correct_reasoning
-                ex.original_category = original_category
-                ex.original_reasoning = original_reasoning
-                ex.operator_comment = operator_comment
-                ex.created_at = datetime.utcnow()
-            else:
-                ex = UserTrainingExample(
-                    user_id=self.user_id,
-                    transcription_hash=transcription_hash,
-                    transcription=transcription,
-                    correct_category=correct_category,
-                    correct_reasoning=correct_reasoning,
-                    original_category=original_category,
-                    original_reasoning=original_reasoning,
-                    operator_comment=operator_comment,
-                )
-                db.session.add(ex)
-            db.session.commit()
-            return True
+            db.session.execute(stmt)
+            if commit:
+                db.session.commit()
+            return len(values)
         except Exception as e:
             db.session.rollback()
             print(f"Ошибка при добавлении обучающего примера: {e}")
-            return False
+            return 0
 
     def get_training_examples(self, category: str = None, limit: int = 10) -> List[Dict]:
-        q = UserTrainingExample.query.filter_by(user_id=self.user_id, is_active=True)
+        q = UserTrainingExample.query.with_entities(
+            UserTrainingExample.id,
+            UserTrainingExample.transcription,
+            UserTrainingExample.correct_category,
+            UserTrainingExample.correct_reasoning,
+            UserTrainingExample.used_count,
+        ).filter_by(user_id=self.user_id, is_active=True)
         if category:
             q = q.filter_by(correct_category=category)
         rows = (
@@ -96,73 +164,53 @@ class TrainingExamplesManager:
             }
             for r in rows
         ]
-        if examples:
-            transcriptions = [ex["transcription"] for ex in examples]
-            for r in UserTrainingExample.query.filter(
+        if rows:
+            UserTrainingExample.query.filter(
                 UserTrainingExample.user_id == self.user_id,
-                UserTrainingExample.transcription.in_(transcriptions),
-            ).all():
-                r.used_count = int(r.used_count or 0) + 1
-            db.session.commit()
+                UserTrainingExample.id.in_([r.id for r in rows]),
+            ).update(
+                {UserTrainingExample.used_count: UserTrainingExample.used_count + 1},
+                synchronize_session=False,
+            )
+            self._commit_counters()
         return examples
 
     def get_similar_examples(self, transcription: str, limit: int = 3) -> List[Dict]:
-        keywords = self._extract_keywords(transcription)
-        examples: List[Dict] = []
-        for keyword in keywords[:5]:
-            rows = (
-                UserTrainingExample.query.filter(
-                    UserTrainingExample.user_id == self.user_id,
-                    UserTrainingExample.is_active == True,  # noqa: E712
-                    UserTrainingExample.transcription.like(f"%{keyword}%"),
-                )
-                .limit(limit)
-                .all()
+        keywords = self._extract_keywords(transcription)[:5]
+        if not keywords:
+            return []
+        matches = [UserTrainingExample.transcription.like(f"%{k}%") for k in keywords]
+        # Один запрос вместо запроса на слово; порядок — по первому совпавшему ключевому слову
+        keyword_rank = case(*[(m, i) for i, m in enumerate(matches)], else_=len(matches))
+        # Текст примера уникален в пределах пользователя (uq_user_training_example_hash),
+        # поэтому строки не повторяются и дедупликация не нужна
+        rows = (
+            UserTrainingExample.query.with_entities(
+                UserTrainingExample.transcription,
+                UserTrainingExample.correct_category,
+                UserTrainingExample.correct_reasoning,
             )
-            for r in rows:
-                example = {
-                    "transcription": r.transcription,
-                    "category": r.correct_category,
-                    "reasoning": r.correct_reasoning,
-                }
-                if example not in examples:
-                    examples.append(example)
-                if len(examples) >= limit:
-                    return examples
-        return examples
+            .filter(
+                UserTrainingExample.user_id == self.user_id,
+                UserTrainingExample.is_active == True,  # noqa: E712
+                or_(*matches),
+            )
+            .order_by(keyword_rank)
+            .limit(limit)
+            .all()
+        )
+        return [
+            {
+                "transcription": r.transcription,
+                "category": r.correct_category,
+                "reasoning": r.correct_reasoning,
+            }
+            for r in rows
+        ]
 
     def _extract_keywords(self, text: str) -> List[str]:
-        important_words = [
-            "запись",
-            "записать",
-            "записывайте",
-            "согласен",
-            "подходит",
-            "отказ",
-            "не нужно",
-            "не интересно",
-            "подумаю",
-            "перезвоню",
-            "дорого",
-            "не по карману",
-            "занято",
-            "нет времени",
-            "не выполняем",
-            "свои запчасти",
-            "мессенджер",
-            "whatsapp",
-            "telegram",
-            "обзвон",
-            "акция",
-            "предложение",
-            "то",
-            "техобслуживание",
-            "переадресация",
-            "другой сервис",
-            "другой адрес",
-        ]
-        text_lower = text.lower()
-        return [w for w in important_words if w in text_lower]
+        found = set(_IMPORTANT_WORDS_RE.findall(text.lower()))
+        return [w for w in _IMPORTANT_WORDS if w in found]
 
     def add_correction(
         self,
@@ -228,38 +276,34 @@ class TrainingExamplesManager:
                     accuracy_rate=accuracy_rate,
                 )
             )
-        db.session.commit()
+        self._commit_counters()
 
     def get_metrics_summary(self, days: int = 30) -> Dict:
-        from sqlalchemy import func
-
         training_stats = db.session.query(
             func.count(UserTrainingExample.id), func.avg(UserTrainingExample.used_count)
         ).filter(UserTrainingExample.user_id == self.user_id, UserTrainingExample.is_active == True).first()  # noqa: E712
 
         since = date.today() - timedelta(days=days)
-        mrows = (
-            UserClassificationMetric.query.filter(
-                UserClassificationMetric.user_id == self.user_id,
-                UserClassificationMetric.metric_date >= since,
+        ucm = UserClassificationMetric
+        metrics = (
+            db.session.query(
+                func.coalesce(func.sum(ucm.total_calls), 0),
+                func.coalesce(func.sum(ucm.correct_classifications), 0),
+                func.coalesce(func.sum(ucm.corrections_made), 0),
+                func.coalesce(func.avg(func.coalesce(ucm.accuracy_rate, 0)), 0),
             )
-            .all()
-        )
-        total_calls = sum((r.total_calls or 0) for r in mrows)
-        correct_c = sum((r.correct_classifications or 0) for r in mrows)
-        corrections_m = sum((r.corrections_made or 0) for r in mrows)
-        avg_acc = (
-            sum((r.accuracy_rate or 0) for r in mrows) / len(mrows) if mrows else 0.0
+            .filter(ucm.user_id == self.user_id, ucm.metric_date >= since)
+            .one()
         )
+        total_calls, correct_c, corrections_m = int(metrics[0]), int(metrics[1]), int(metrics[2])
+        avg_acc = float(metrics[3])
 
         since_dt = datetime.utcnow() - timedelta(days=days)
-        from sqlalchemy import func as sfunc
-
         top_rows = (
             db.session.query(
                 UserCorrectionHistory.original_category,
                 UserCorrectionHistory.corrected_category,
-                sfunc.count().label("cnt"),
+                func.count().label("cnt"),
             )
             .filter(
                 UserCorrectionHistory.user_id == self.user_id,
@@ -269,7 +313,7 @@ class TrainingExamplesManager:
                 UserCorrectionHistory.original_category,
                 UserCorrectionHistory.corrected_category,
             )
-            .order_by(sfunc.count().desc())
+            .order_by(func.count().desc())
             .limit(10)
             .all()
         )
@@ -285,14 +329,33 @@ class TrainingExamplesManager:
             ],
         }
 
-    def get_all_examples(self) -> List[Dict]:
-        rows = (
-            UserTrainingExample.query.filter_by(user_id=self.user_id)
-            .order_by(UserTrainingExample.created_at.desc())
-            .all()
+    def _examples_query(self, category: Optional[str] = None):
+        q = UserTrainingExample.query.with_entities(*_EXAMPLE_COLUMNS).filter_by(
+            user_id=self.user_id
         )
-        return [
-            {
+        if category:
+            q = q.filter_by(correct_category=category)
+        return q
+
+    def count_examples(self, category: Optional[str] = None) -> int:
+        q = db.session.query(func.count(UserTrainingExample.id)).filter(
+            UserTrainingExample.user_id == self.user_id
+        )
+        if category:
+            q = q.filter(UserTrainingExample.correct_category == category)
+        return int(q.scalar() or 0)
+
+    def iter_all_examples(
+        self, category: Optional[str] = None, offset: int = 0, limit: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """Примеры (новые первыми) по одному; строки читаются пачками по 100."""
+        q = self._examples_query(category).order_by(UserTrainingExample.created_at.desc())
+        if offset:
+            q = q.offset(int(offset))
+        if limit is not None:
+            q = q.limit(int(limit))
+        for r in q.yield_per(100):
+            yield {
                 "id": r.id,
                 "transcription": r.transcription,
                 "correct_category": r.correct_category,
@@ -302,10 +365,11 @@ class TrainingExamplesManager:
                 "operator_comment": r.operator_comment,
                 "created_at": r.created_at.isoformat() if r.created_at else None,
                 "used_count": r.used_count,
-                "is_active": bool(r.is_active),
+                "is_active": r.is_active,
             }
-            for r in rows
-        ]
+
+    def get_all_examples(self) -> List[Dict]:
+        return list(self.iter_all_examples())
 
     def toggle_example_status(self, example_id: int) -> bool:
         try:
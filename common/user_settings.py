@@ -1,5 +1,4 @@
-from copy import deepcopy
-from pathlib import Path
+import os
 
 
 def default_config_template():
@@ -90,15 +89,24 @@ def default_config_template():
             # Хранение исходных аудиозаписей на сервере (дней). 0 — не удалять автоматически.
             'audio_retention_days': 10,
         },
-        'filename': {
-            'enabled': False,
-            'patterns': [],
-            'extensions': ['.mp3', '.wav']
-        },
+        'filename': default_filename_template(),
         'allowed_stations': []
     }
 
 
+def default_filename_template():
+    return {
+        'enabled': False,
+        'patterns': [],
+        'extensions': ['.mp3', '.wav']
+    }
+
+
+# Секция transcription шаблона — только для чтения (слияние в build_runtime_config),
+# чтобы не строить весь шаблон ради значений по умолчанию
+_TRANSCRIPTION_DEFAULTS = default_config_template()['transcription']
+
+
 def default_prompts_template():
     return {
         'default': '',
@@ -128,13 +136,37 @@ def default_script_prompt_template():
     }
 
 
-def _merge_telegram(config_data, _fallback):
+# Атрибуты legacy-config, подставляемые вместо пустых значений профиля, и их значения по умолчанию
+_FALLBACK_DEFAULTS = {
+    'ALERT_CHAT_ID': '',
+    'TG_CHANNEL_NIZH': '',
+    'TG_CHANNEL_OTHER': '',
+    'REPORTS_CHAT_ID': '',
+    'MAX_ALERT_CHAT_ID': '',
+    'MAX_TG_CHANNEL_NIZH': '',
+    'MAX_TG_CHANNEL_OTHER': '',
+    'MAX_REPORTS_CHAT_ID': '',
+    'SPEECHMATICS_API_KEY': '',
+    'THEBAI_API_KEY': '',
+    'THEBAI_URL': 'https://api.deepseek.com/v1/chat/completions',
+    'THEBAI_MODEL': 'deepseek-reasoner',
+    'TELEGRAM_BOT_TOKEN': '',
+    'MAX_ACCESS_TOKEN': '',
+    'GEMINI_API_KEY': '',
+    'BASE_RECORDS_PATH': '',
+    'PROMPTS_FILE': '',
+    'ADDITIONAL_VOCAB_FILE': '',
+    'SCRIPT_PROMPT_8_PATH': '',
+}
+
+
+def _merge_telegram(config_data, fb):
     base = {
         'notifications_enabled': True,
-        'alert_chat_id': _fallback('ALERT_CHAT_ID', ''),
-        'tg_channel_nizh': _fallback('TG_CHANNEL_NIZH', ''),
-        'tg_channel_other': _fallback('TG_CHANNEL_OTHER', ''),
-        'reports_chat_id': _fallback('REPORTS_CHAT_ID', ''),
+        'alert_chat_id': fb['ALERT_CHAT_ID'],
+        'tg_channel_nizh': fb['TG_CHANNEL_NIZH'],
+        'tg_channel_other': fb['TG_CHANNEL_OTHER'],
+        'reports_chat_id': fb['REPORTS_CHAT_ID'],
     }
     over = config_data.get('telegram') or {}
     base.update(over)
@@ -143,14 +175,14 @@ def _merge_telegram(config_data, _fallback):
     return base
 
 
-def _merge_max(config_data, _fallback):
+def _merge_max(config_data, fb):
     base = {
         'notifications_enabled': True,
         'send_checklist_analysis_file': True,
-        'alert_chat_id': _fallback('MAX_ALERT_CHAT_ID', ''),
-        'tg_channel_nizh': _fallback('MAX_TG_CHANNEL_NIZH', ''),
-        'tg_channel_other': _fallback('MAX_TG_CHANNEL_OTHER', ''),
-        'reports_chat_id': _fallback('MAX_REPORTS_CHAT_ID', ''),
+        'alert_chat_id': fb['MAX_ALERT_CHAT_ID'],
+        'tg_channel_nizh': fb['MAX_TG_CHANNEL_NIZH'],
+        'tg_channel_other': fb['MAX_TG_CHANNEL_OTHER'],
+        'reports_chat_id': fb['MAX_REPORTS_CHAT_ID'],
     }
     over = config_data.get('max') or {}
     base.update(over)
@@ -165,63 +197,68 @@ def build_runtime_config(project_config, config_data=None, user_id=None):
     """
     Собирает конфигурацию профиля с учётом значений по умолчанию и legacy-config.
     Возвращает (runtime_config, updated_config_data, changed_flag).
+
+    config_data не изменяется: копируются только верхний уровень и изменяемые
+    секции (paths, transcription). Остальные вложенные словари и списки
+    runtime и updated_config_data разделяют с входными данными.
     """
-    config_data = deepcopy(config_data) if config_data else default_config_template()
+    config_data = dict(config_data) if config_data else default_config_template()
     changed = False
 
-    def _fallback(attr, default=''):
-        return getattr(project_config, attr, default) if hasattr(project_config, attr) else default
+    # Значения legacy-config читаются один раз за вызов
+    fb = {attr: getattr(project_config, attr, default) for attr, default in _FALLBACK_DEFAULTS.items()}
 
     api_keys_cfg = config_data.get('api_keys') or {}
     runtime_api_keys = {
-        'speechmatics_api_key': api_keys_cfg.get('speechmatics_api_key') or _fallback('SPEECHMATICS_API_KEY', ''),
-        'thebai_api_key': api_keys_cfg.get('thebai_api_key') or _fallback('THEBAI_API_KEY', ''),
-        'thebai_url': api_keys_cfg.get('thebai_url') or _fallback('THEBAI_URL', 'https://api.deepseek.com/v1/chat/completions'),
-        'thebai_model': api_keys_cfg.get('thebai_model') or _fallback('THEBAI_MODEL', 'deepseek-reasoner'),
-        'telegram_bot_token': api_keys_cfg.get('telegram_bot_token') or _fallback('TELEGRAM_BOT_TOKEN', ''),
-        'max_access_token': api_keys_cfg.get('max_access_token') or _fallback('MAX_ACCESS_TOKEN', ''),
-        'gemini_api_key': api_keys_cfg.get('gemini_api_key') or _fallback('GEMINI_API_KEY', ''),
+        'speechmatics_api_key': api_keys_cfg.get('speechmatics_api_key') or fb['SPEECHMATICS_API_KEY'],
+        'thebai_api_key': api_keys_cfg.get('thebai_api_key') or fb['THEBAI_API_KEY'],
+        'thebai_url': api_keys_cfg.get('thebai_url') or fb['THEBAI_URL'],
+        'thebai_model': api_keys_cfg.get('thebai_model') or fb['THEBAI_MODEL'],
+        'telegram_bot_token': api_keys_cfg.get('telegram_bot_token') or fb['TELEGRAM_BOT_TOKEN'],
+        'max_access_token': api_keys_cfg.get('max_access_token') or fb['MAX_ACCESS_TOKEN'],
+        'gemini_api_key': api_keys_cfg.get('gemini_api_key') or fb['GEMINI_API_KEY'],
     }
 
-    paths_cfg = config_data.get('paths') or {}
+    paths_cfg = dict(config_data.get('paths') or {})
     base_records_path = (paths_cfg.get('base_records_path') or '').strip()
-    default_base = _fallback('BASE_RECORDS_PATH', '')
+    default_base = fb['BASE_RECORDS_PATH']
     if user_id and default_base and not base_records_path:
-        base_records_path = str(Path(str(default_base)) / 'users' / str(user_id))
+        base_records_path = os.path.join(str(default_base), 'users', str(user_id))
         paths_cfg['base_records_path'] = base_records_path
         changed = True
     
     # Автоматически формируем пути к конфигурационным файлам в пользовательской директории
+    # (os.path.join: нужны только строки, семантика Path здесь не используется)
     user_config_dir = None
     if user_id and base_records_path:
-        user_config_dir = Path(base_records_path) / 'config'
+        user_config_dir = os.path.join(base_records_path, 'config')
     
     prompts_file = paths_cfg.get('prompts_file') or ''
     if not prompts_file:
         if user_config_dir:
-            prompts_file = str(user_config_dir / 'prompts.yaml')
+            prompts_file = os.path.join(user_config_dir, 'prompts.yaml')
             paths_cfg['prompts_file'] = prompts_file
             changed = True
         else:
-            prompts_file = str(_fallback('PROMPTS_FILE', ''))
+            prompts_file = str(fb['PROMPTS_FILE'])
     
     additional_vocab_file = paths_cfg.get('additional_vocab_file') or ''
     if not additional_vocab_file:
         if user_config_dir:
-            additional_vocab_file = str(user_config_dir / 'additional_vocab.yaml')
+            additional_vocab_file = os.path.join(user_config_dir, 'additional_vocab.yaml')
             paths_cfg['additional_vocab_file'] = additional_vocab_file
             changed = True
         else:
-            additional_vocab_file = str(_fallback('ADDITIONAL_VOCAB_FILE', ''))
+            additional_vocab_file = str(fb['ADDITIONAL_VOCAB_FILE'])
     
     script_prompt_file = paths_cfg.get('script_prompt_file') or ''
     if not script_prompt_file:
         if user_config_dir:
-            script_prompt_file = str(user_config_dir / 'script_prompt_8.yaml')
+            script_prompt_file = os.path.join(user_config_dir, 'script_prompt_8.yaml')
             paths_cfg['script_prompt_file'] = script_prompt_file
             changed = True
         else:
-            script_prompt_file = str(_fallback('SCRIPT_PROMPT_8_PATH', ''))
+            script_prompt_file = str(fb['SCRIPT_PROMPT_8_PATH'])
     runtime_paths = {
         'base_records_path': base_records_path or str(default_base),
         'prompts_file': prompts_file,
@@ -234,10 +271,9 @@ def build_runtime_config(project_config, config_data=None, user_id=None):
     vocabulary_cfg = config_data.get('vocabulary') or {}
     vocab_enabled = vocabulary_cfg.get('enabled', True)  # По умолчанию True
 
-    _tx_defaults = default_config_template()['transcription']
     raw_transcription = config_data.get('transcription') or {}
     # Полная секция: устаревшие/частичные JSON без новых ключей получают значения по умолчанию
-    transcription_cfg = {**_tx_defaults, **raw_transcription}
+    transcription_cfg = {**_TRANSCRIPTION_DEFAULTS, **raw_transcription}
     # Если use_additional_vocab не задан явно в исходных данных, берем из vocabulary.enabled
     if 'use_additional_vocab' not in raw_transcription:
         transcription_cfg['use_additional_vocab'] = vocab_enabled
@@ -247,8 +283,8 @@ def build_runtime_config(project_config, config_data=None, user_id=None):
         'api_keys': runtime_api_keys,
         'paths': runtime_paths,
         'llm_provider': (config_data.get('llm_provider') or 'deepseek'),
-        'telegram': _merge_telegram(config_data, _fallback),
-        'max': _merge_max(config_data, _fallback),
+        'telegram': _merge_telegram(config_data, fb),
+        'max': _merge_max(config_data, fb),
         # Для SaaS-режима станции, маппинги и сотрудники должны
         # браться только из пользовательских настроек/таблиц,
         # а не подмешиваться из глобального legacy-конфига.
@@ -260,7 +296,7 @@ def build_runtime_config(project_config, config_data=None, user_id=None):
         'station_mapping': config_data.get('station_mapping') or {},
         'nizh_station_codes': config_data.get('nizh_station_codes') or [],
         'transcription': transcription_cfg,
-        'filename': config_data.get('filename') or default_config_template()['filename'],
+        'filename': config_data.get('filename') or default_filename_template(),
         'allowed_stations': config_data.get('allowed_stations') or []
     }
     
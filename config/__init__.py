@@ -16,10 +16,16 @@ _PROJECT_ROOT = Path(__file__).resolve().parent.parent
 _LEGACY_CONFIG_PATH = _PROJECT_ROOT / 'call_analyzer' / 'config.py'
 _LEGACY_MODULE_NAME = '_legacy_call_analyzer_config'
 _legacy_module = None
+# Имена legacy-атрибутов, закэшированные в globals() через __getattr__
+_legacy_names = set()
 
 
 def _load_legacy():
-    """Ленивая загрузка call_analyzer/config.py."""
+    """
+    Ленивая загрузка call_analyzer/config.py.
+    Вызывается только при первом обращении к legacy-атрибуту (см. __getattr__),
+    поэтому простой `import config` не читает и не исполняет файл.
+    """
     global _legacy_module
     if _legacy_module is not None:
         return _legacy_module
@@ -36,12 +42,6 @@ def _load_legacy():
     sys.modules[_LEGACY_MODULE_NAME] = module
     spec.loader.exec_module(module)  # type: ignore[attr-defined]
     _legacy_module = module
-
-    for attr in dir(module):
-        if attr.startswith('__'):
-            continue
-        globals().setdefault(attr, getattr(module, attr))
-
     return _legacy_module
 
 
@@ -49,6 +49,11 @@ def reload_legacy_config():
     """Принудительная перезагрузка legacy-конфига."""
     global _legacy_module
     _legacy_module = None
+    sys.modules.pop(_LEGACY_MODULE_NAME, None)
+    # Сбрасываем закэшированные значения, иначе __getattr__ их уже не увидит
+    for name in _legacy_names:
+        globals().pop(name, None)
+    _legacy_names.clear()
     return _load_legacy()
 
 
@@ -57,8 +62,7 @@ def __getattr__(name):
     if legacy and hasattr(legacy, name):
         value = getattr(legacy, name)
         globals()[name] = value
+        _legacy_names.add(name)
         return value
     raise AttributeError(f"module 'config' has no attribute '{name}'")
 
-
-_load_legacy()
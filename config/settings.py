@@ -6,44 +6,44 @@
 
 import os
 from pathlib import Path
+from functools import lru_cache
 from urllib.parse import quote_plus, urlparse
 
 
+def _build_db_uri():
+    """URI базы: валидный DATABASE_URL или сборка из DB_* параметров."""
+    db_url = os.getenv('DATABASE_URL')
+    if db_url:
+        # Убеждаемся, что строка в правильной кодировке
+        if isinstance(db_url, bytes):
+            db_url = db_url.decode('utf-8', errors='replace')
+        # Проверяем, что это валидный URL (urlparse — один раз)
+        try:
+            parsed = urlparse(db_url)
+        except ValueError:
+            parsed = None
+        if parsed is not None and parsed.scheme and parsed.netloc:
+            return db_url
+
+    # Используем отдельные параметры:
+    # это позволяет избежать проблем с кодировкой в путях Windows
+    db_host = os.getenv('DB_HOST', 'localhost')
+    db_port = os.getenv('DB_PORT', '5432')
+    db_user = os.getenv('DB_USER', os.getenv('DATABASE_USER', 'postgres'))
+    db_password = os.getenv('DB_PASSWORD', os.getenv('DATABASE_PASSWORD', 'postgres'))
+    db_name = os.getenv('DB_NAME', os.getenv('DATABASE_NAME', 'saas'))
+    return f"postgresql://{quote_plus(db_user)}:{quote_plus(db_password)}@{db_host}:{db_port}/{db_name}"
+
+
 class Config:
     """Базовая конфигурация"""
     # Flask
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     
     # База данных
-    # Используем отдельные параметры или DATABASE_URL
-    # Это позволяет избежать проблем с кодировкой в путях Windows
-    _db_host = os.getenv('DB_HOST', 'localhost')
-    _db_port = os.getenv('DB_PORT', '5432')
-    _db_user = os.getenv('DB_USER', os.getenv('DATABASE_USER', 'postgres'))
-    _db_password = os.getenv('DB_PASSWORD', os.getenv('DATABASE_PASSWORD', 'postgres'))
-    _db_name = os.getenv('DB_NAME', os.getenv('DATABASE_NAME', 'saas'))
-    
-    # Если есть DATABASE_URL, используем его, иначе формируем из параметров
-    _db_url = os.getenv('DATABASE_URL')
-    if _db_url:
-        # Убеждаемся, что строка в правильной кодировке
-        if isinstance(_db_url, bytes):
-            _db_url = _db_url.decode('utf-8', errors='replace')
-        # Проверяем, что это валидный URL
-        try:
-            parsed = urlparse(_db_url)
-            if parsed.scheme and parsed.netloc:
-                SQLALCHEMY_DATABASE_URI = _db_url
-            else:
-                raise ValueError("Invalid DATABASE_URL format")
-        except Exception:
-            # Если парсинг не удался, формируем из параметров
-            _db_url = f"postgresql://{quote_plus(_db_user)}:{quote_plus(_db_password)}@{_db_host}:{_db_port}/{_db_name}"
-            SQLALCHEMY_DATABASE_URI = _db_url
-    else:
-        # Формируем URL из отдельных параметров
-        _db_url = f"postgresql://{quote_plus(_db_user)}:{quote_plus(_db_password)}@{_db_host}:{_db_port}/{_db_name}"
-        SQLALCHEMY_DATABASE_URI = _db_url
+    # Используем DATABASE_URL или формируем URI из отдельных параметров.
+    # Строится один раз при определении класса; подклассы наследуют готовое значение.
+    SQLALCHEMY_DATABASE_URI = _build_db_uri()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_size': 10,
@@ -133,7 +133,8 @@ config_map = {
     'default': DevelopmentConfig
 }
 
+@lru_cache(maxsize=1)
 def get_config():
-    """Получить конфигурацию на основе FLASK_ENV"""
+    """Получить конфигурацию на основе FLASK_ENV (FLASK_ENV читается один раз на процесс)"""
     env = os.getenv('FLASK_ENV', 'development')
     return config_map.get(env, DevelopmentConfig)
@@ -6,14 +6,120 @@
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy.orm import Session
+
 from .models import db, TransferCase, RecallCase
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 logger = logging.getLogger(__name__)
 
 
+def _iter_json_items(json_file_path: Path) -> Iterator[Dict[str, Any]]:
+    """
+    Итерирует элементы JSON-массива из файла.
+    С ijson — потоково, без загрузки всего списка в память; иначе через json.load.
+    """
+    if ijson is not None:
+        with open(json_file_path, 'rb') as f:
+            # use_float: числа как float, а не Decimal (иначе не сериализуются в JSON-колонки)
+            yield from ijson.items(f, 'item', use_float=True)
+        return
+    with open(json_file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    yield from data
+
+
+# Размер пачки для bulk_insert_mappings (один executemany на пачку)
+_BULK_CHUNK_SIZE = 500
+
+
+def _parse_dt(value):
+    """ISO-строка → datetime; прочие значения возвращаются как есть."""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _bulk_insert(session, model, rows: List[Dict[str, Any]]) -> None:
+    """Вставка новых строк пачками без ORM-объектов (без identity map и событий)."""
+    for start in range(0, len(rows), _BULK_CHUNK_SIZE):
+        session.bulk_insert_mappings(model, rows[start:start + _BULK_CHUNK_SIZE])
+
+
+def _migrate_cases(json_file_path: Path, session, default_user_id: int, model, case_fields) -> int:
+    """
+    Общий проход миграции: существующие кейсы (user_id, phone_number, call_time)
+    обновляются через ORM, новые копятся словарями и вставляются пачками.
+    Дубликаты внутри файла схлопываются: более поздняя запись обновляет раннюю.
+    Ключи существующих кейсов читаются одним запросом на пользователя
+    (при первой встрече его user_id), а не SELECT на каждую запись.
+    """
+    migrated_count = 0
+    new_rows: Dict[tuple, Dict[str, Any]] = {}
+    existing_ids: Dict[tuple, int] = {}
+    loaded_users = set()
+    for item in _iter_json_items(json_file_path):
+        target_user_id = item.get('user_id') or default_user_id
+        phone_number = item.get('phone_number')
+        call_time = _parse_dt(item.get('call_time'))
+        fields = {
+            'deadline': _parse_dt(item.get('deadline')),
+            'status': item.get('status', 'waiting'),
+            'analysis': item.get('analysis'),
+            'tg_msg_id': item.get('tg_msg_id'),
+            'notified': item.get('notified', False),
+        }
+        for name in case_fields:
+            fields[name] = item.get(name)
+        if item.get('remind_at'):
+            fields['remind_at'] = _parse_dt(item['remind_at'])
+
+        key = (target_user_id, phone_number, call_time)
+        pending = new_rows.get(key)
+        if pending is not None:
+            pending.update(fields)
+            migrated_count += 1
+            continue
+
+        if target_user_id not in loaded_users:
+            loaded_users.add(target_user_id)
+            rows = session.query(
+                model.id, model.phone_number, model.call_time
+            ).filter(model.user_id == target_user_id)
+            for case_id, case_phone, case_time in rows:
+                existing_ids[(target_user_id, case_phone, case_time)] = case_id
+
+        # Проверяем, существует ли уже такой кейс
+        existing_id = existing_ids.get(key)
+        if existing_id is not None:
+            # Обновляем существующий
+            existing = session.get(model, existing_id)
+            for name, value in fields.items():
+                setattr(existing, name, value)
+        else:
+            # Новый — вставим пачкой после прохода по файлу
+            new_rows[key] = {
+                'user_id': target_user_id,
+                'phone_number': phone_number,
+                'station_code': item.get('station_code'),
+                'call_time': call_time,
+                'remind_at': None,
+                **fields,
+            }
+        migrated_count += 1
+
+    _bulk_insert(session, model, list(new_rows.values()))
+    session.commit()
+    return migrated_count
+
+
 def migrate_transfer_cases_from_json(json_file_path: Path, session, default_user_id: int = 1):
     """
     Мигрирует данные переводов из JSON в базу данных
@@ -27,50 +133,9 @@ def migrate_transfer_cases_from_json(json_file_path: Path, session, default_user
         return 0
     
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        migrated_count = 0
-        for item in data:
-            # Проверяем, существует ли уже такой кейс
-            target_user_id = item.get('user_id') or default_user_id
-            existing = session.query(TransferCase).filter_by(
-                user_id=target_user_id,
-                phone_number=item.get('phone_number'),
-                call_time=datetime.fromisoformat(item['call_time']) if isinstance(item.get('call_time'), str) else item.get('call_time')
-            ).first()
-            
-            if existing:
-                # Обновляем существующий
-                existing.deadline = datetime.fromisoformat(item['deadline']) if isinstance(item.get('deadline'), str) else item.get('deadline')
-                existing.status = item.get('status', 'waiting')
-                existing.target_station = item.get('target_station')
-                existing.analysis = item.get('analysis')
-                existing.tg_msg_id = item.get('tg_msg_id')
-                existing.notified = item.get('notified', False)
-                if 'remind_at' in item and item['remind_at']:
-                    existing.remind_at = datetime.fromisoformat(item['remind_at']) if isinstance(item.get('remind_at'), str) else item.get('remind_at')
-                migrated_count += 1
-            else:
-                # Создаем новый
-                transfer = TransferCase(
-                    user_id=target_user_id,
-                    phone_number=item.get('phone_number'),
-                    station_code=item.get('station_code'),
-                    call_time=datetime.fromisoformat(item['call_time']) if isinstance(item.get('call_time'), str) else item.get('call_time'),
-                    deadline=datetime.fromisoformat(item['deadline']) if isinstance(item.get('deadline'), str) else item.get('deadline'),
-                    status=item.get('status', 'waiting'),
-                    target_station=item.get('target_station'),
-                    analysis=item.get('analysis'),
-                    tg_msg_id=item.get('tg_msg_id'),
-                    notified=item.get('notified', False)
-                )
-                if 'remind_at' in item and item['remind_at']:
-                    transfer.remind_at = datetime.fromisoformat(item['remind_at']) if isinstance(item.get('remind_at'), str) else item.get('remind_at')
-                session.add(transfer)
-                migrated_count += 1
-        
-        session.commit()
+        migrated_count = _migrate_cases(
+            json_file_path, session, default_user_id, TransferCase, ('target_station',)
+        )
         logger.info(f"Мигрировано {migrated_count} записей переводов из {json_file_path}")
         return migrated_count
         
@@ -93,52 +158,9 @@ def migrate_recall_cases_from_json(json_file_path: Path, session, default_user_i
         return 0
     
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        migrated_count = 0
-        for item in data:
-            # Проверяем, существует ли уже такой кейс
-            target_user_id = item.get('user_id') or default_user_id
-            existing = session.query(RecallCase).filter_by(
-                user_id=target_user_id,
-                phone_number=item.get('phone_number'),
-                call_time=datetime.fromisoformat(item['call_time']) if isinstance(item.get('call_time'), str) else item.get('call_time')
-            ).first()
-            
-            if existing:
-                # Обновляем существующий
-                existing.deadline = datetime.fromisoformat(item['deadline']) if isinstance(item.get('deadline'), str) else item.get('deadline')
-                existing.status = item.get('status', 'waiting')
-                existing.recall_station = item.get('recall_station')
-                existing.recall_when = item.get('recall_when')
-                existing.analysis = item.get('analysis')
-                existing.tg_msg_id = item.get('tg_msg_id')
-                existing.notified = item.get('notified', False)
-                if 'remind_at' in item and item['remind_at']:
-                    existing.remind_at = datetime.fromisoformat(item['remind_at']) if isinstance(item.get('remind_at'), str) else item.get('remind_at')
-                migrated_count += 1
-            else:
-                # Создаем новый
-                recall = RecallCase(
-                    user_id=target_user_id,
-                    phone_number=item.get('phone_number'),
-                    station_code=item.get('station_code'),
-                    call_time=datetime.fromisoformat(item['call_time']) if isinstance(item.get('call_time'), str) else item.get('call_time'),
-                    deadline=datetime.fromisoformat(item['deadline']) if isinstance(item.get('deadline'), str) else item.get('deadline'),
-                    status=item.get('status', 'waiting'),
-                    recall_station=item.get('recall_station'),
-                    recall_when=item.get('recall_when'),
-                    analysis=item.get('analysis'),
-                    tg_msg_id=item.get('tg_msg_id'),
-                    notified=item.get('notified', False)
-                )
-                if 'remind_at' in item and item['remind_at']:
-                    recall.remind_at = datetime.fromisoformat(item['remind_at']) if isinstance(item.get('remind_at'), str) else item.get('remind_at')
-                session.add(recall)
-                migrated_count += 1
-        
-        session.commit()
+        migrated_count = _migrate_cases(
+            json_file_path, session, default_user_id, RecallCase, ('recall_station', 'recall_when')
+        )
         logger.info(f"Мигрировано {migrated_count} записей перезвонов из {json_file_path}")
         return migrated_count
         
@@ -162,8 +184,23 @@ def run_migrations(project_root: Path, db_session, default_user_id: Optional[int
     recall_file = project_root / 'recall_cases.json'
     
     tenant_id = default_user_id or int(os.getenv('DEFAULT_TENANT_USER_ID', '1'))
-    transfer_count = migrate_transfer_cases_from_json(transfer_file, db_session, tenant_id)
-    recall_count = migrate_recall_cases_from_json(recall_file, db_session, tenant_id)
+    if transfer_file.exists() and recall_file.exists():
+        # Таблицы не пересекаются: гоняем обе миграции параллельно,
+        # каждую в своей сессии (Session не потокобезопасна)
+        engine = db_session.get_bind()
+
+        def _run(migrate, json_file):
+            with Session(engine) as session:
+                return migrate(json_file, session, tenant_id)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            transfer_future = pool.submit(_run, migrate_transfer_cases_from_json, transfer_file)
+            recall_future = pool.submit(_run, migrate_recall_cases_from_json, recall_file)
+            transfer_count = transfer_future.result()
+            recall_count = recall_future.result()
+    else:
+        transfer_count = migrate_transfer_cases_from_json(transfer_file, db_session, tenant_id)
+        recall_count = migrate_recall_cases_from_json(recall_file, db_session, tenant_id)
     
     logger.info(f"Миграция завершена: {transfer_count} переводов, {recall_count} перезвонов")
     return transfer_count + recall_count
@@ -111,6 +111,7 @@ class TransferCase(db.Model):
     __table_args__ = (
         Index('idx_transfers_status_deadline', 'user_id', 'status', 'deadline'),
         Index('idx_transfers_remind', 'user_id', 'remind_at', 'notified'),
+        Index('idx_transfers_phone_time', 'user_id', 'phone_number', 'call_time'),
     )
 
     def __repr__(self):
@@ -143,6 +144,7 @@ class RecallCase(db.Model):
     __table_args__ = (
         Index('idx_recalls_status_deadline', 'user_id', 'status', 'deadline'),
         Index('idx_recalls_remind', 'user_id', 'remind_at', 'notified'),
+        Index('idx_recalls_phone_time', 'user_id', 'phone_number', 'call_time'),
     )
 
     def __repr__(self):
@@ -853,7 +855,14 @@ class UserClassificationRule(db.Model):
 
     user = db.relationship('User', backref=db.backref('classification_rules_rel', lazy='dynamic', cascade='all, delete-orphan'))
 
-    __table_args__ = (Index('idx_ucr_user_priority', 'user_id', 'priority'),)
+    __table_args__ = (
+        Index('idx_ucr_user_priority', 'user_id', 'priority'),
+        Index(
+            'idx_ucr_user_active_priority',
+            'user_id', db.text('priority DESC'), 'category_id',
+            postgresql_where=db.text('is_active'),
+        ),
+    )
 
 
 class UserClassificationCriticalRule(db.Model):
@@ -871,6 +880,14 @@ class UserClassificationCriticalRule(db.Model):
 
     user = db.relationship('User', backref=db.backref('classification_critical_rules', lazy='dynamic', cascade='all, delete-orphan'))
 
+    __table_args__ = (
+        Index(
+            'idx_uccr_user_active_created',
+            'user_id', 'created_at',
+            postgresql_where=db.text('is_active'),
+        ),
+    )
+
 
 class UserClassificationSetting(db.Model):
     """Key/value настройки (бывш. system_settings)."""
@@ -887,8 +904,8 @@ class UserClassificationSetting(db.Model):
     user = db.relationship('User', backref=db.backref('classification_settings', lazy='dynamic', cascade='all, delete-orphan'))
 
     __table_args__ = (
+        # Уникальный (user_id, setting_key) покрывает и выборки по одному user_id
         db.UniqueConstraint('user_id', 'setting_key', name='uq_user_classification_setting_key'),
-        Index('idx_ucset_user', 'user_id'),
     )
 
 
@@ -944,7 +961,10 @@ class UserClassificationSchedule(db.Model):
 
     user = db.relationship('User', backref=db.backref('classification_schedules_rel', lazy='dynamic', cascade='all, delete-orphan'))
 
-    __table_args__ = (Index('idx_ucsch_user_next', 'user_id', 'next_run'),)
+    __table_args__ = (
+        Index('idx_ucsch_user_next', 'user_id', 'next_run'),
+        Index('idx_ucsch_active_due', 'next_run', 'user_id', postgresql_where=db.text('is_active')),
+    )
 
 
 class UserAutoExtractedRule(db.Model):
@@ -987,6 +1007,10 @@ class UserTrainingExample(db.Model):
     __table_args__ = (
         db.UniqueConstraint('user_id', 'transcription_hash', name='uq_user_training_example_hash'),
         Index('idx_ute_user_cat', 'user_id', 'correct_category'),
+        Index(
+            'idx_ute_user_active_cat_used', 'user_id', 'correct_category', 'used_count',
+            postgresql_where=db.text('is_active'),
+        ),
     )
 
 
@@ -1029,6 +1053,11 @@ class UserCorrectionHistory(db.Model):
 
     user = db.relationship('User', backref=db.backref('correction_history', lazy='dynamic', cascade='all, delete-orphan'))
 
+    __table_args__ = (
+        # Покрывающий для GROUP BY original_category, corrected_category по периоду
+        Index('idx_uch_user_date_cats', 'user_id', 'correction_date', 'original_category', 'corrected_category'),
+    )
+
 
 class UserCorrectClassification(db.Model):
     """Подтверждения правильных классификаций."""
@@ -1050,7 +1079,9 @@ class UserCorrectClassification(db.Model):
     user = db.relationship('User', backref=db.backref('correct_classifications', lazy='dynamic', cascade='all, delete-orphan'))
 
     __table_args__ = (
-        Index('idx_ucc_user_confirmed', 'user_id', 'confirmed_at'),
+        # Покрывающий для GROUP BY category по периоду подтверждений
+        Index('idx_ucc_user_confirmed_cat', 'user_id', 'confirmed_at', 'category'),
+        Index('idx_ucc_user_call', 'user_id', 'phone_number', 'call_date', 'call_time'),
     )
 
 
@@ -1129,3 +1160,10 @@ class UserSuccessPattern(db.Model):
     last_confirmed = db.Column(db.DateTime, nullable=True)
 
     user = db.relationship('User', backref=db.backref('success_patterns', lazy='dynamic', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        Index(
+            'idx_usp_user_category_active', 'user_id', 'category', 'confirmation_count',
+            postgresql_where=db.text('is_active'),
+        ),
+    )
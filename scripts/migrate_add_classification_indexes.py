@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Миграция: индексы для горячих запросов подсистемы классификации.
+
+db.create_all() не добавляет индексы в уже существующие таблицы, поэтому
+индексы из database.models создаются здесь через CREATE INDEX IF NOT EXISTS.
+Здесь же — параметры хранения часто обновляемых таблиц-счётчиков.
+"""
+
+import sys
+import logging
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+if sys.platform == 'win32':
+    import io
+    try:
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+    except AttributeError:
+        pass
+
+env_path = project_root / '.env'
+if env_path.exists():
+    load_dotenv(env_path, encoding='utf-8')
+else:
+    load_dotenv(encoding='utf-8')
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+INDEXES_DDL = [
+    # Активные правила: WHERE user_id = ? AND is_active ORDER BY priority DESC, category_id
+    """
+    CREATE INDEX IF NOT EXISTS idx_ucr_user_active_priority
+      ON user_classification_rules (user_id, priority DESC, category_id)
+      WHERE is_active;
+    """,
+    # Активные критические правила: WHERE user_id = ? AND is_active ORDER BY created_at DESC
+    """
+    CREATE INDEX IF NOT EXISTS idx_uccr_user_active_created
+      ON user_classification_critical_rules (user_id, created_at)
+      WHERE is_active;
+    """,
+    # Опрос планировщика: WHERE is_active AND next_run <= now() по всем пользователям
+    """
+    CREATE INDEX IF NOT EXISTS idx_ucsch_active_due
+      ON user_classification_schedules (next_run, user_id)
+      WHERE is_active;
+    """,
+    # get_setting / set_setting: WHERE user_id = ? AND setting_key = ?
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_user_classification_setting_key
+      ON user_classification_settings (user_id, setting_key);
+    """,
+    # Дублирует префикс uq_user_classification_setting_key, только удорожает запись
+    """
+    DROP INDEX IF EXISTS idx_ucset_user;
+    """,
+    # get_classification_task / update_classification_task: WHERE user_id = ? AND task_id = ?
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_user_classification_history_task
+      ON user_classification_history (user_id, task_id);
+    """,
+    # get_classification_history: WHERE user_id = ? ORDER BY start_time DESC LIMIT ?
+    """
+    CREATE INDEX IF NOT EXISTS idx_uch_user_start
+      ON user_classification_history (user_id, start_time);
+    """,
+    # mark_as_correct: WHERE user_id = ? AND phone_number = ? AND call_date = ? AND call_time = ?
+    """
+    CREATE INDEX IF NOT EXISTS idx_ucc_user_call
+      ON user_correct_classifications (user_id, phone_number, call_date, call_time);
+    """,
+    # _update_success_patterns: WHERE user_id = ? AND category = ? AND is_active ORDER BY confirmation_count DESC
+    """
+    CREATE INDEX IF NOT EXISTS idx_usp_user_category_active
+      ON user_success_patterns (user_id, category, confirmation_count)
+      WHERE is_active;
+    """,
+    # analyze_learning_progress / get_metrics_summary:
+    # WHERE user_id = ? AND correction_date >= ? GROUP BY original_category, corrected_category
+    """
+    CREATE INDEX IF NOT EXISTS idx_uch_user_date_cats
+      ON user_correction_history (user_id, correction_date, original_category, corrected_category);
+    """,
+    """
+    DROP INDEX IF EXISTS idx_uch_corr_user_date;
+    """,
+    # learn_from_successful_classifications: WHERE user_id = ? AND confirmed_at >= ? GROUP BY category
+    """
+    CREATE INDEX IF NOT EXISTS idx_ucc_user_confirmed_cat
+      ON user_correct_classifications (user_id, confirmed_at, category);
+    """,
+    # Префикс idx_ucc_user_confirmed_cat
+    """
+    DROP INDEX IF EXISTS idx_ucc_user_confirmed;
+    """,
+    # get_training_examples / get_metrics_summary: WHERE user_id = ? AND is_active [AND correct_category = ?]
+    """
+    CREATE INDEX IF NOT EXISTS idx_ute_user_active_cat_used
+      ON user_training_examples (user_id, correct_category, used_count)
+      WHERE is_active;
+    """,
+    # Горячие счётчики (upsert на каждое подтверждение): запас места на странице позволяет
+    # HOT-обновления без записи в индексы; на уже заполненных страницах — после VACUUM FULL
+    """
+    ALTER TABLE user_classification_success_stats SET (fillfactor = 70);
+    """,
+    """
+    ALTER TABLE user_example_effectiveness SET (fillfactor = 70);
+    """,
+]
+
+
+def get_db_url():
+    try:
+        from config.settings import get_config
+        return get_config().SQLALCHEMY_DATABASE_URI
+    except Exception as exc:
+        logger.error("Не удалось получить SQLALCHEMY_DATABASE_URI: %s", exc)
+        raise
+
+
+def run_migration():
+    db_url = get_db_url()
+    engine = create_engine(db_url)
+    logger.info("Подключение к БД: %s", db_url.split('@')[-1] if '@' in db_url else db_url)
+    failed = []
+    try:
+        with engine.connect() as conn:
+            # Каждый оператор — в своей транзакции: например, уникальный индекс на старой базе
+            # с дубликатами не должен откатывать остальные индексы
+            for ddl in INDEXES_DDL:
+                statement = " ".join(ddl.split())
+                try:
+                    with conn.begin():
+                        conn.execute(text(ddl))
+                except Exception as exc:
+                    failed.append(statement)
+                    logger.error("Не выполнено: %s — %s", statement, exc)
+    finally:
+        engine.dispose()
+    done = len(INDEXES_DDL) - len(failed)
+    if failed:
+        logger.error("Миграция индексов классификации: выполнено %d, ошибок %d.", done, len(failed))
+        raise RuntimeError(f"Не выполнено операторов: {len(failed)}")
+    logger.info("Индексы классификации созданы (%d).", done)
+
+
+if __name__ == "__main__":
+    run_migration()
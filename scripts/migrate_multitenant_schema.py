@@ -91,6 +91,7 @@ def main():
                 [
                     "CREATE INDEX IF NOT EXISTS idx_transfers_status_deadline ON transfer_cases (user_id, status, deadline)",
                     "CREATE INDEX IF NOT EXISTS idx_transfers_remind ON transfer_cases (user_id, remind_at, notified)",
+                    "CREATE INDEX IF NOT EXISTS idx_transfers_phone_time ON transfer_cases (user_id, phone_number, call_time)",
                 ],
             )
             migrate_table(
@@ -99,6 +100,7 @@ def main():
                 [
                     "CREATE INDEX IF NOT EXISTS idx_recalls_status_deadline ON recall_cases (user_id, status, deadline)",
                     "CREATE INDEX IF NOT EXISTS idx_recalls_remind ON recall_cases (user_id, remind_at, notified)",
+                    "CREATE INDEX IF NOT EXISTS idx_recalls_phone_time ON recall_cases (user_id, phone_number, call_time)",
                 ],
             )
             migrate_table(
@@ -26,7 +26,7 @@ from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
 
 from classification_module.classification_engine import CallClassificationEngine
-from classification_module.classification_rules import ClassificationRulesManager
+from classification_module.classification_rules import ClassificationRulesManager, due_schedule_user_ids
 from classification_module.max_notify import send_excel_report_to_max
 from classification_module.self_learning_system import SelfLearningSystem
 from classification_module.training_examples import TrainingExamplesManager
@@ -879,20 +879,36 @@ def _find_task_for_schedule(user_id: int, schedule_id: int) -> Dict | None:
 
 def _process_due_schedules(flask_app):
     with flask_app.app_context():
-        users = User.query.all()
+        # Менеджеры создаются только для пользователей с наступившими расписаниями
+        due_user_ids = due_schedule_user_ids()
+        users = User.query.filter(User.id.in_(due_user_ids)).all() if due_user_ids else []
         for user in users:
             user_id = int(user.id)
             cr = _classification_root_for(user_id)
             rm = ClassificationRulesManager(user_id=user_id, classification_root=cr)
+            claimed = []
             for schedule in rm.get_due_schedules():
-                schedule_id = int(schedule["id"])
-                schedule_key = _schedule_key(user_id, schedule_id)
+                schedule_key = _schedule_key(user_id, int(schedule["id"]))
                 with _tasks_lock:
                     if schedule_key in _running_schedule_keys:
                         continue
                     _running_schedule_keys.add(schedule_key)
+                claimed.append(schedule)
+            if not claimed:
+                continue
+            # next_run всех захваченных расписаний переносится одним UPDATE
+            try:
+                rm.advance_due_schedules(claimed)
+            except Exception:
+                with _tasks_lock:
+                    for schedule in claimed:
+                        _running_schedule_keys.discard(_schedule_key(user_id, int(schedule["id"])))
+                flask_app.logger.exception("Failed to advance due schedules: user=%s", user_id)
+                continue
+            for schedule in claimed:
+                schedule_id = int(schedule["id"])
+                schedule_key = _schedule_key(user_id, schedule_id)
                 try:
-                    rm.update_next_run(schedule_id)
                     input_path = _resolve_schedule_input_folder(user_id, schedule)
                     base = _user_base_records_path_for(user_id).resolve()
                     if not input_path:
@@ -1390,7 +1406,7 @@ def api_schedule_run(schedule_id):
         schedule_id=int(schedule_id),
         app_obj=current_app._get_current_object(),
     )
-    rm.update_next_run(schedule_id)
+    rm.update_next_run(schedule_id, schedule.get("schedule_type"), schedule.get("schedule_config"))
     return jsonify({"success": True, "task_id": task_id})
 
 
@@ -1527,17 +1543,15 @@ def training_page():
     per_page = 30
     category_filter = str(request.args.get("category", "") or "").strip()
 
-    all_examples = manager.get_all_examples()
-    if category_filter:
-        filtered = [item for item in all_examples if str(item.get("correct_category", "")) == category_filter]
-    else:
-        filtered = all_examples
-
-    total = len(filtered)
+    total = manager.count_examples(category_filter or None)
     pages = max((total + per_page - 1) // per_page, 1)
     if page > pages:
         page = pages
-    examples_page = filtered[(page - 1) * per_page : page * per_page]
+    examples_page = list(
+        manager.iter_all_examples(
+            category_filter or None, offset=(page - 1) * per_page, limit=per_page
+        )
+    )
     categories = _categories_from_dataframe(_load_all_results_df().fillna(""))
     for item in examples_page:
         code = str(item.get("correct_category", "") or "")
@@ -1914,7 +1928,7 @@ def api_generate_prompt_preview():
 @classification_bp.route("/api/scheduler/status")
 @login_required
 def api_scheduler_status():
-    active_count = len(_rules_manager().get_schedules(active_only=True))
+    active_count = len(_rules_manager().get_schedules_summary(active_only=True))
     return jsonify(
         {
             "success": True,